@@ -0,0 +1,425 @@
+import config, json, platform, statistics, sys, threading, time
+from argparse import ArgumentParser
+
+'''
+Offline benchmark of the parts of a node that decide Block Time and Throughput: hashing,
+mining, transaction creation/signing, transaction validation, coin selection and the encoding of
+messages between nodes. Everything runs in this
+process (no Flask, no network), for every combination of nodes/difficulty/capacity given.
+
+Usage: python benchmark.py [-n 5 10] [-d 4 5] [-c 1 5 10] [-r 3] [-t 50] [-s rsa:4096 ed25519]
+                           [-k oldest_first largest_first branch_and_bound consolidating]
+                           [-o benchmark_results.json]
+                           [--baseline previous.json] [--tolerance 0.2]
+'''
+
+HASH_ATTEMPTS = 20000 # attempts used to measure hash rate
+WIRE_ROUNDS = 200 # encodings/decodings of every message measured
+
+
+'''
+Bring node to the state it has right after bootstrap: a ring of `nodes` wallets,
+a genesis block that gives 100 * nodes NBC to node 0 and pending UTXOs equal to UTXOs.
+'''
+def reset_node(node, wallets, nodes, capacity):
+    from block import Block
+    from blockchain import Blockchain
+    from ring import Ring
+    from transaction import Transaction
+    from transaction_io import Transaction_Output
+    from utxo import UTXOSet
+
+    config.nodes = nodes
+    config.capacity = capacity
+    node.chain = Blockchain(capacity)
+    node.ring = Ring()
+    node.UTXOs = UTXOSet()
+    node.current_id_count = 0
+    node.wallet = wallets[0]
+    for i in range(0, nodes):
+        node.register_node_to_ring(i, '127.0.0.1', 5000 + i, wallets[i].public_key)
+    genesis = Block(1, 0)
+    first_txn = Transaction(node.wallet.address, node.wallet.address, 100 * nodes, [])
+    node.UTXOs.add(Transaction_Output(first_txn.transaction_id, 0, first_txn.amount))
+    genesis.add_transaction(first_txn)
+    genesis.current_hash = genesis.myHash()
+    node.chain.add_block(genesis)
+    node.current_block = node.create_new_block(genesis.current_hash, 1)
+    node.pending_UTXOs = node.UTXOs.overlay()
+
+
+'''
+Create (and sign) `count` transactions of 1 NBC from node 0 to the other nodes, validating
+each one so that the next one finds its inputs. Both phases are timed separately.
+
+return: (list of Transaction, float, float)
+    transactions created, seconds spent creating/signing, seconds spent validating
+'''
+def run_transactions(node, count):
+    transactions = []
+    create_time = 0
+    validate_time = 0
+    for i in range(0, count):
+        recipient = node.ring[1 + i % (len(node.ring) - 1)]
+        start = time.perf_counter()
+        inputs, inputs_sum = node.get_transaction_inputs(1)
+        transaction = node.create_transaction(recipient['ip'], recipient['port'], 1, inputs, inputs_sum)
+        create_time += time.perf_counter() - start
+        start = time.perf_counter()
+        valid = node.validate_transaction(transaction)
+        validate_time += time.perf_counter() - start
+        if not valid:
+            raise RuntimeError("benchmark transaction is not valid")
+        transactions.append(transaction)
+    return transactions, create_time, validate_time
+
+
+'''
+Build a sealed block on top of the node's chain containing `capacity` transactions
+'''
+def build_block(node, transactions, capacity):
+    block = node.create_new_block(node.chain.blocks[-1].current_hash, len(node.chain.blocks))
+    for transaction in transactions[:capacity]:
+        block.add_transaction(transaction)
+    block.target = node.chain.get_target(block.index)
+    block.seal()
+    return block
+
+
+'''
+Measure how many Block.myHash() calls (full header encoding per attempt) and how many
+nonce attempts of the mining loop (pre-hashed header prefix) run per second
+
+return: (float, float)
+'''
+def measure_hash_rate(node, block):
+    start = time.perf_counter()
+    for nonce in range(0, HASH_ATTEMPTS):
+        block.nonce = nonce
+        block.myHash()
+    my_hash_rate = HASH_ATTEMPTS / (time.perf_counter() - start)
+
+    # a target that is never reached, the search is stopped by the interrupt after a second
+    target = block.target
+    block.target = 1
+    node.interrupt.clear()
+    timer = threading.Timer(1, node.interrupt.trigger, ("benchmark",))
+    timer.start()
+    node.search_nonce(block)
+    timer.join()
+    cancellation = node.interrupt.cancellations[-1]
+    node.interrupt.clear()
+    block.target = target
+    return my_hash_rate, cancellation['attempts'] / cancellation['mining_time']
+
+
+'''
+Measure signature verification throughput: serially with Transaction.verify_signature(),
+in parallel with a fresh SignatureVerifier and again with its cache filled
+
+return: dict
+'''
+def measure_verification(node, transactions):
+    from verification import SignatureVerifier
+
+    start = time.perf_counter()
+    for transaction in transactions:
+        transaction.verify_signature(node.get_public_key(transaction.sender_address))
+    serial = len(transactions) / (time.perf_counter() - start)
+
+    verifier = SignatureVerifier(config.verification_workers, config.signature_cache_size, node.get_public_key)
+    start = time.perf_counter()
+    if not verifier.verify_all(transactions):
+        raise RuntimeError("benchmark signature is not valid")
+    parallel = len(transactions) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    verifier.verify_all(transactions)
+    cached = len(transactions) / (time.perf_counter() - start)
+    verifier.executor.shutdown()
+    return dict(serial_per_sec = serial, parallel_per_sec = parallel, cached_per_sec = cached)
+
+
+'''
+Replay the simulation workload of transactions/<nodes>nodes (the files of all nodes interleaved,
+one line of each in turn) on a bare UTXO set, choosing inputs with a coin selection strategy.
+Signatures and blocks are left out, only the effect of the strategy on transactions is measured.
+
+return: dict
+'''
+def replay_coin_selection(strategy, nodes):
+    from transaction_io import Transaction_Input, Transaction_Output
+    from utxo import UTXOSet
+
+    workload = []
+    for i in range(0, nodes):
+        with open("transactions/" + str(nodes) + "nodes/transactions" + str(i) + ".txt") as file:
+            workload.append([(i, int(line.split(" ")[0][-1]), int(line.split(" ")[1])) for line in file if line.strip() != ""])
+    lines = [line for turn in zip(*workload) for line in turn]
+
+    utxos = UTXOSet()
+    for i in range(0, nodes):
+        utxos.add(Transaction_Output("genesis" + str(i), i, 100))
+    inputs = []
+    sizes = []
+    encoded = []
+    failed = 0
+    select_time = 0
+    for count, (sender, recipient, amount) in enumerate(lines):
+        start = time.perf_counter()
+        selected = strategy.select(utxos[sender], amount)
+        select_time += time.perf_counter() - start
+        if selected == None:
+            failed += 1
+            continue
+        transaction_id = "txn" + str(count)
+        total = sum(output.amount for output in selected)
+        outputs = [Transaction_Output(transaction_id, recipient, amount, 1)]
+        if total > amount:
+            outputs.append(Transaction_Output(transaction_id, sender, total - amount, 0))
+        for output in selected:
+            utxos.spend(output.get_outpoint())
+        for output in outputs:
+            utxos.add(output)
+        inputs.append(len(selected))
+        sizes.append(len(utxos))
+        encoded.append(len(json.dumps(
+            [Transaction_Input(output.id, output.recipient, output.amount, output.index).to_dict() for output in selected] +
+            [output.to_dict() for output in outputs]
+        )))
+    return dict(
+        transactions = len(inputs),
+        failed = failed,
+        average_inputs = statistics.mean(inputs),
+        max_inputs = max(inputs),
+        average_utxos = statistics.mean(sizes),
+        final_utxos = len(utxos),
+        average_io_bytes = statistics.mean(encoded),
+        select_time = select_time / len(lines)
+    )
+
+
+'''
+Measure the size of a message between nodes and the time to encode and decode it, in both
+wire formats: 'json' (fields encoded with jsonpickle, the JSON body sent) and 'binary' (see wire)
+
+return: list of dict
+'''
+def measure_wire(name, message):
+    import jsonpickle, wire
+
+    formats = [
+        ('json', lambda: json.dumps({key: jsonpickle.encode(value) for key, value in message.items()}).encode(),
+            lambda data: {key: jsonpickle.decode(value) for key, value in json.loads(data).items()}),
+        ('binary', lambda: wire.encode(message), wire.decode)
+    ]
+    measured = []
+    for wire_format, encode, decode in formats:
+        start = time.perf_counter()
+        for _ in range(0, WIRE_ROUNDS):
+            data = encode()
+        encode_time = (time.perf_counter() - start) / WIRE_ROUNDS
+        start = time.perf_counter()
+        for _ in range(0, WIRE_ROUNDS):
+            decode(data)
+        decode_time = (time.perf_counter() - start) / WIRE_ROUNDS
+        measured.append(dict(message = name, format = wire_format, bytes = len(data), encode_time = encode_time, decode_time = decode_time))
+    return measured
+
+
+def summarize(samples):
+    return dict(
+        mean = statistics.mean(samples),
+        median = statistics.median(samples),
+        min = min(samples),
+        max = max(samples),
+        samples = len(samples)
+    )
+
+
+'''
+Compare results with a previous run and list the metrics that got worse by more than tolerance
+(times that grew or rates that dropped)
+
+return: list of str
+'''
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    def compare(section, key_fields, metrics):
+        previous = {tuple(item[k] for k in key_fields): item for item in baseline.get(section, [])}
+        for item in results[section]:
+            key = tuple(item[k] for k in key_fields)
+            if key not in previous:
+                continue
+            for metric, higher_is_better in metrics:
+                old, new = previous[key][metric], item[metric]
+                if isinstance(old, dict):
+                    old, new = old['median'], new['median']
+                if old == 0:
+                    continue
+                change = (new - old) / old
+                if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                    regressions.append(section + " " + str(dict(zip(key_fields, key))) + " " + metric + ": " + str(round(old, 4)) + " -> " + str(round(new, 4)))
+    compare('hashing', ['capacity'], [('my_hash_per_sec', True), ('attempts_per_sec', True)])
+    compare('mining', ['difficulty', 'capacity'], [('time_to_solution', False)])
+    compare('keys', ['scheme'], [('generated_per_sec', True)])
+    compare('transactions', ['scheme', 'nodes'], [('created_per_sec', True), ('validated_per_sec', True)])
+    compare('verification', ['scheme'], [('serial_per_sec', True), ('parallel_per_sec', True), ('cached_per_sec', True)])
+    compare('coin_selection', ['strategy', 'nodes'], [('average_inputs', False), ('final_utxos', False)])
+    compare('wire', ['message', 'format'], [('bytes', False), ('encode_time', False), ('decode_time', False)])
+    return regressions
+
+
+def main():
+    from coin_selection import STRATEGIES, get_strategy
+
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--nodes', nargs='+', type=int, default=[5, 10], help='ring sizes')
+    parser.add_argument('-d', '--difficulty', nargs='+', type=int, default=[4, 5], help='mining difficulties')
+    parser.add_argument('-c', '--capacity', nargs='+', type=int, default=[1, 5, 10], help='block capacities')
+    parser.add_argument('-r', '--repeat', default=3, type=int, help='blocks mined per difficulty/capacity')
+    parser.add_argument('-t', '--transactions', default=50, type=int, help='transactions created/validated per ring size')
+    parser.add_argument('-s', '--schemes', nargs='+', default=[config.signature_scheme + ':' + str(config.signature_key_size)], help='signature schemes, e.g. rsa:4096 rsa:2048 ed25519')
+    parser.add_argument('-k', '--coin-selection', nargs='+', default=[strategy.name for strategy in STRATEGIES], help='coin selection strategies')
+    parser.add_argument('-p', '--processes', default=config.mining_processes, type=int, help='mining processes')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='file to write results to')
+    parser.add_argument('--baseline', default=None, help='previous results to compare with')
+    parser.add_argument('--tolerance', default=0.2, type=float, help='allowed relative regression')
+    args = parser.parse_args()
+
+    config.mining_processes = args.processes
+    config.DEBUG = False
+    from node import Node
+    from wallet import Wallet
+    from signature import get_scheme
+
+    node = Node('127.0.0.1', 5000, 0)
+    node.broadcast_block = lambda block: None
+    max_nodes = max(args.nodes)
+
+    results = dict(
+        environment = dict(
+            python = platform.python_version(),
+            machine = platform.machine(),
+            processes = args.processes,
+            repeat = args.repeat
+        ),
+        keys = [],
+        transactions = [],
+        verification = [],
+        hashing = [],
+        mining = [],
+        coin_selection = [],
+        wire = [],
+        blocks = []
+    )
+
+    # key generation, transaction creation/validation and verification depend on the signature
+    # scheme, creation/validation also on the size of the ring
+    sample = None
+    for label in args.schemes:
+        name, _, key_size = label.partition(':')
+        scheme = get_scheme(name, int(key_size) if key_size != '' else config.signature_key_size)
+        start = time.perf_counter()
+        wallets = [Wallet(scheme) for _ in range(0, max_nodes)]
+        results['keys'].append(dict(scheme = label, generated_per_sec = max_nodes / (time.perf_counter() - start)))
+
+        for nodes in args.nodes:
+            reset_node(node, wallets, nodes, max(args.capacity))
+            created, create_time, validate_time = run_transactions(node, max(args.transactions, max(args.capacity)))
+            if sample == None:
+                sample = created
+            results['transactions'].append(dict(
+                scheme = label,
+                nodes = nodes,
+                created_per_sec = len(created) / create_time,
+                validated_per_sec = len(created) / validate_time,
+                create_time = create_time / len(created),
+                validate_time = validate_time / len(created)
+            ))
+            print(label + ", nodes=" + str(nodes) + ": " + str(round(len(created) / create_time, 1)) + " txn/s created, " + str(round(len(created) / validate_time, 1)) + " txn/s validated")
+
+        # signatures one by one, in parallel and from the cache
+        verification = measure_verification(node, created)
+        results['verification'].append(dict(scheme = label, **verification))
+        print(label + ", verification: " + ", ".join(key + "=" + str(round(value, 1)) + " txn/s" for key, value in verification.items()))
+
+    # hashing and mining depend on the block only
+    for capacity in args.capacity:
+        block = build_block(node, sample, capacity)
+        my_hash_rate, attempts_rate = measure_hash_rate(node, block)
+        results['hashing'].append(dict(
+            capacity = capacity,
+            my_hash_per_sec = my_hash_rate,
+            attempts_per_sec = attempts_rate
+        ))
+        print("capacity=" + str(capacity) + ": " + str(round(my_hash_rate)) + " myHash/s, " + str(round(attempts_rate)) + " attempts/s")
+
+    for difficulty in args.difficulty:
+        config.difficulty = difficulty
+        for capacity in args.capacity:
+            samples = []
+            for _ in range(0, args.repeat):
+                block = build_block(node, sample, capacity)
+                start = time.perf_counter()
+                node.search_nonce(block)
+                samples.append(time.perf_counter() - start)
+                if not node.validate_block(block):
+                    raise RuntimeError("benchmark block is not valid")
+            results['mining'].append(dict(
+                difficulty = difficulty,
+                capacity = capacity,
+                time_to_solution = summarize(samples)
+            ))
+            print("difficulty=" + str(difficulty) + ", capacity=" + str(capacity) + ": " + str(round(statistics.median(samples), 3)) + " s to solution (median)")
+
+    # inputs per transaction and size of the UTXO set under the simulation workloads
+    for name in args.coin_selection:
+        for nodes in args.nodes:
+            selection = replay_coin_selection(get_strategy(name), nodes)
+            results['coin_selection'].append(dict(strategy = name, nodes = nodes, **selection))
+            print(name + ", nodes=" + str(nodes) + ": " + str(round(selection['average_inputs'], 2)) + " inputs/txn, " + str(selection['final_utxos']) + " UTXOs at the end")
+
+    # size and encoding/decoding time of the messages nodes send most: transactions, blocks (also
+    # sent in batches when resolving conflicts) and, once, the ring
+    messages = [('transaction', {'transaction': sample[0]}), ('ring', {'ring': node.ring})]
+    for capacity in args.capacity:
+        messages.append(('block, capacity=' + str(capacity), {'block': build_block(node, sample, capacity)}))
+    for name, message in messages:
+        measured = measure_wire(name, message)
+        results['wire'] += measured
+        print(name + ": " + ", ".join(item['format'] + " " + str(item['bytes']) + " bytes, " + str(round(item['encode_time'] * 1e6)) + "/" + str(round(item['decode_time'] * 1e6)) + " us to encode/decode" for item in measured))
+
+    # estimated block time/throughput of a single node for the whole matrix: capacity transactions
+    # created and validated, followed by the mining of the block
+    for item in results['transactions']:
+        for mined in results['mining']:
+            block_time = mined['time_to_solution']['mean'] + mined['capacity'] * (item['create_time'] + item['validate_time'])
+            results['blocks'].append(dict(
+                scheme = item['scheme'],
+                nodes = item['nodes'],
+                difficulty = mined['difficulty'],
+                capacity = mined['capacity'],
+                block_time = block_time,
+                throughput = mined['capacity'] / block_time
+            ))
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print("Results written to " + args.output)
+
+    if node.miner != None:
+        node.miner.shutdown()
+
+    if args.baseline != None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,34 @@
+import hashlib, json, time
+import merkle
+
+
+'''
+Encode the fields of a header that are hashed together with the nonce
+
+Parameters:
+-----------
+header: dict
+	index, previous_hash, timestamp, target and merkle_root (e.g. Block.get_header())
+
+return: bytes
+'''
+def encode_header_prefix(header):
+	return json.dumps(dict(
+		index = header['index'],
+		previous_hash = header['previous_hash'],
+		timestamp = header['timestamp'],
+		target = header['target'],
+		merkle_root = header['merkle_root']
+	)).encode()
+
+'''
+Calculate the hash of a header without its block, the same way Block.myHash() does
+
+return: str
+'''
+def get_header_hash(header):
+	return hashlib.sha256(encode_header_prefix(header) + header['nonce'].to_bytes(8, 'big')).hexdigest()
 
-import json
-from Crypto.Hash import SHA256
 
 class Block:
 	'''
@@ -12,23 +40,118 @@ class Block:
 		self.nonce = 0
 		self.current_hash = None # will change after it's hashed
 		self.previous_hash = previous_hash
-	
+		self.timestamp = time.time() # will change when mining starts
+		self.target = None # hash must be below it, set when mining starts
+		self.merkle_root = None # will change after it's sealed
+		self.merkle_tree = None # levels of the tree, kept locally and never sent
+
 	'''
-	Calculate current hash:
-	Create a dict with block's information and encrypt it
+	Leave the Merkle tree out when the block is serialized or copied,
+	it can always be rebuilt from the transactions
 	'''
-	def myHash(self):
-		block_info = json.dumps(dict(
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['merkle_tree'] = None
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		if 'merkle_tree' not in state:
+			self.merkle_tree = None
+
+	'''
+	Get the leaves of the Merkle tree: one hash per transaction, in block order
+
+	return: list of str
+	'''
+	def get_leaves(self):
+		return [item.get_leaf_hash() for item in self.transactions]
+
+	'''
+	Seal the block:
+	Build the Merkle tree of its transactions once and keep its root in the header,
+	so that hashing the block only needs its fixed-size header
+	'''
+	def seal(self):
+		self.merkle_tree = merkle.build_tree(self.get_leaves())
+		self.merkle_root = self.merkle_tree[-1][0]
+
+	'''
+	Check that the Merkle root in the header commits to the block's transactions
+
+	return: bool
+	'''
+	def verify_merkle_root(self):
+		return self.merkle_root == merkle.build_tree(self.get_leaves())[-1][0]
+
+	'''
+	Check that no transaction appears twice in the block
+
+	return: bool
+	'''
+	def has_unique_transactions(self):
+		return len(set(item.transaction_id for item in self.transactions)) == len(self.transactions)
+
+	'''
+	Get the inclusion proof of a transaction of this block
+
+	Parameters:
+	-----------
+	transaction_id: str
+		id of the transaction
+
+	return: (str, list of [str, str]) | None
+		leaf hash of the transaction and its proof, or None if it isn't in this block
+	'''
+	def get_proof(self, transaction_id):
+		index = next((i for i, item in enumerate(self.transactions) if item.transaction_id == transaction_id), None)
+		if index == None:
+			return None
+		if self.merkle_tree == None:
+			self.merkle_tree = merkle.build_tree(self.get_leaves())
+		return self.merkle_tree[0][index], merkle.get_proof(self.merkle_tree, index)
+
+	'''
+	Get the encoded header without the nonce:
+	index, previous hash, timestamp, target and Merkle root (seals block if needed)
+
+	return: bytes
+	'''
+	def header_prefix(self):
+		if self.merkle_root == None:
+			self.seal()
+		return encode_header_prefix(self.__dict__)
+
+	'''
+	Get the header of the block: every field but the transactions, which the Merkle root commits to
+
+	return: dict
+	'''
+	def get_header(self):
+		if self.merkle_root == None:
+			self.seal()
+		return dict(
 			index = self.index,
-			transactions = [item.to_dict() for item in self.transactions],
+			previous_hash = self.previous_hash,
+			timestamp = self.timestamp,
+			target = self.target,
+			merkle_root = self.merkle_root,
 			nonce = self.nonce,
-			previous_hash = self.previous_hash
-		))
-		return SHA256.new(block_info.encode()).hexdigest()
+			current_hash = self.current_hash
+		)
+
+	'''
+	Calculate current hash:
+	Hash the header prefix followed by the nonce (8 bytes, big endian)
+	'''
+	def myHash(self):
+		return hashlib.sha256(self.header_prefix() + self.nonce.to_bytes(8, 'big')).hexdigest()
 
 	'''
 	Add a transaction to the block:
-	Essentially append it to transactions list
+	Essentially append it to transactions list (block has to be sealed again)
 	'''
 	def add_transaction(self, transaction):
 		self.transactions.append(transaction)
+		self.merkle_root = None
+		self.merkle_tree = None
@@ -0,0 +1,213 @@
+import jsonpickle, mmap, os, threading
+from collections import OrderedDict
+
+INDEX_ENTRY_SIZE = 80 # offset (8 bytes) + length (8 bytes) + block hash (64 hex characters)
+HASH_SIZE = 64
+
+
+class BlockStore:
+
+	'''
+	Initialize an append-only store of blocks on disk, in a directory with two files:
+	blocks.dat, the blocks encoded one after the other, and blocks.idx, one fixed size entry
+	per height with the offset, length and hash of the block in blocks.dat. Reads go through
+	a memory map of blocks.dat, only the hash -> height index is kept in memory.
+	A block written only partly (node stopped while writing) is dropped when the store is opened.
+
+	Attributes
+	----------
+	path: str
+		directory of the store
+	data: file
+		blocks.dat, opened for reading and appending
+	index: file
+		blocks.idx, opened for reading and appending
+	heights: dict
+		block hash -> height
+	length: int
+		number of blocks stored
+	map: mmap | None
+		memory map of blocks.dat, remapped when it has grown
+	'''
+	def __init__(self, path):
+		os.makedirs(path, exist_ok=True)
+		self.path = path
+		self.lock = threading.RLock() # also held by StoredBlocks around its cache
+		self.data = open(os.path.join(path, 'blocks.dat'), 'a+b')
+		self.index = open(os.path.join(path, 'blocks.idx'), 'a+b')
+		self.map = None
+		self.heights = {}
+		self.length = 0
+		self.recover()
+
+	'''
+	Load the hash -> height index and cut off entries (and data) of blocks not written completely
+	'''
+	def recover(self):
+		data_size = os.fstat(self.data.fileno()).st_size
+		self.index.seek(0)
+		entries = os.fstat(self.index.fileno()).st_size // INDEX_ENTRY_SIZE
+		end = 0
+		for height in range(0, entries):
+			offset, length, block_hash = self.parse_entry(self.index.read(INDEX_ENTRY_SIZE))
+			if offset + length > data_size:
+				break
+			self.heights[block_hash] = height
+			self.length = height + 1
+			end = offset + length
+		self.index.truncate(self.length * INDEX_ENTRY_SIZE)
+		self.data.truncate(end)
+
+	def parse_entry(self, entry):
+		return int.from_bytes(entry[0:8], 'big'), int.from_bytes(entry[8:16], 'big'), entry[16:].decode().rstrip()
+
+	def read_entry(self, height):
+		self.index.seek(height * INDEX_ENTRY_SIZE)
+		return self.parse_entry(self.index.read(INDEX_ENTRY_SIZE))
+
+	def __len__(self):
+		return self.length
+
+	def __contains__(self, block_hash):
+		return block_hash in self.heights
+
+	'''
+	Write a block after the last one
+
+	Parameters:
+	-----------
+	block: Block
+		block at height len(store)
+	'''
+	def append(self, block):
+		encoded = jsonpickle.encode(block).encode()
+		block_hash = str(block.current_hash)
+		with self.lock:
+			self.data.seek(0, os.SEEK_END)
+			offset = self.data.tell()
+			self.data.write(encoded)
+			self.data.flush()
+			os.fsync(self.data.fileno())
+			# the entry is written last, a block is only stored once its entry is complete
+			self.index.write(offset.to_bytes(8, 'big') + len(encoded).to_bytes(8, 'big') + block_hash.ljust(HASH_SIZE)[:HASH_SIZE].encode())
+			self.index.flush()
+			os.fsync(self.index.fileno())
+			self.heights[block_hash] = self.length
+			self.length += 1
+
+	'''
+	Read the block at a height
+
+	return: Block
+	'''
+	def get(self, height):
+		with self.lock:
+			if height < 0 or height >= self.length:
+				raise IndexError("no block at height " + str(height))
+			offset, length, _ = self.read_entry(height)
+			if self.map == None or offset + length > len(self.map):
+				if self.map != None:
+					self.map.close()
+				self.map = mmap.mmap(self.data.fileno(), 0, access=mmap.ACCESS_READ)
+			encoded = self.map[offset:offset + length]
+		return jsonpickle.decode(encoded.decode())
+
+	'''
+	Get the height of a block from its hash
+
+	return: int | None
+	'''
+	def get_height(self, block_hash):
+		return self.heights.get(block_hash)
+
+	'''
+	Remove the blocks from a height on (used when the node switches to another branch)
+
+	Parameters:
+	-----------
+	height: int
+		number of blocks to keep
+	'''
+	def truncate(self, height):
+		with self.lock:
+			if height >= self.length:
+				return
+			if self.map != None:
+				self.map.close()
+				self.map = None
+			for removed in range(height, self.length):
+				del self.heights[self.read_entry(removed)[2]]
+			offset = self.read_entry(height)[0]
+			self.length = height
+			self.index.truncate(height * INDEX_ENTRY_SIZE)
+			self.data.truncate(offset)
+
+	def close(self):
+		with self.lock:
+			if self.map != None:
+				self.map.close()
+			self.data.close()
+			self.index.close()
+
+
+class StoredBlocks:
+
+	'''
+	Initialize a list of blocks kept in a BlockStore, used as Blockchain.blocks. It supports what the
+	node does with a list of blocks (len, indexing, slicing, iteration, append and del blocks[n:])
+	while only the last cache_size blocks read or written are kept in memory.
+
+	Attributes
+	----------
+	store: BlockStore
+		where the blocks are kept
+	cache_size: int
+		how many blocks are kept in memory
+	cache: OrderedDict
+		height -> Block, least recently used first, only used while holding store.lock
+		(blocks are read from the Flask threads and the worker)
+	'''
+	def __init__(self, store, cache_size):
+		self.store = store
+		self.cache_size = cache_size
+		self.cache = OrderedDict()
+
+	def __len__(self):
+		return len(self.store)
+
+	def remember(self, height, block):
+		# called with store.lock held
+		self.cache[height] = block
+		self.cache.move_to_end(height)
+		while len(self.cache) > self.cache_size:
+			self.cache.popitem(last=False)
+
+	def __getitem__(self, item):
+		if isinstance(item, slice):
+			return [self[height] for height in range(*item.indices(len(self)))]
+		with self.store.lock:
+			height = item + len(self) if item < 0 else item
+			if height in self.cache:
+				self.cache.move_to_end(height)
+				return self.cache[height]
+			block = self.store.get(height)
+			self.remember(height, block)
+			return block
+
+	def __iter__(self):
+		for height in range(0, len(self)):
+			yield self[height]
+
+	def __delitem__(self, item):
+		if not isinstance(item, slice) or item.stop != None or item.step != None:
+			raise TypeError("only the end of the chain can be removed (del blocks[height:])")
+		with self.store.lock:
+			height = item.start + len(self) if item.start < 0 else item.start
+			self.store.truncate(height)
+			for cached in [cached for cached in self.cache if cached >= height]:
+				del self.cache[cached]
+
+	def append(self, block):
+		with self.store.lock:
+			self.store.append(block)
+			self.remember(len(self) - 1, block)
@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+
+
+class BlockTree:
+
+	'''
+	Initialize the pool of blocks received that are not part of the chain: blocks of side branches
+	(forks of the chain that may become heavier than it) and orphans (blocks whose previous block
+	hasn't been received yet). Side branches are kept so that the node can switch to one of them
+	without asking the other nodes for its blocks.
+
+	Attributes
+	----------
+	size: int
+		most blocks kept, the oldest received are forgotten first
+	blocks: OrderedDict
+		block hash -> Block, oldest first
+	children: dict
+		block hash -> set of hashes of the blocks of the pool whose previous block it is
+	'''
+	def __init__(self, size):
+		self.size = size
+		self.lock = threading.RLock()
+		self.blocks = OrderedDict()
+		self.children = {}
+
+	def __contains__(self, block_hash):
+		return block_hash in self.blocks
+
+	def __len__(self):
+		return len(self.blocks)
+
+	def get(self, block_hash):
+		return self.blocks.get(block_hash)
+
+	def add(self, block):
+		with self.lock:
+			if block.current_hash in self.blocks:
+				return
+			self.blocks[block.current_hash] = block
+			self.children.setdefault(block.previous_hash, set()).add(block.current_hash)
+			while len(self.blocks) > self.size:
+				self.remove(next(iter(self.blocks)))
+
+	def remove(self, block_hash):
+		with self.lock:
+			block = self.blocks.pop(block_hash, None)
+			if block == None:
+				return
+			siblings = self.children.get(block.previous_hash)
+			if siblings != None:
+				siblings.discard(block_hash)
+				if len(siblings) == 0:
+					del self.children[block.previous_hash]
+
+	'''
+	Get the branch that ends at a block of the pool: the block and the blocks of the pool before it,
+	oldest first (so the previous block of the first one is not in the pool)
+
+	return: list of Block
+	'''
+	def get_branch(self, block_hash):
+		branch = []
+		with self.lock:
+			while block_hash in self.blocks:
+				branch.append(self.blocks[block_hash])
+				block_hash = self.blocks[block_hash].previous_hash
+		branch.reverse()
+		return branch
+
+	'''
+	Get the blocks of the pool that follow a block (directly or not) and have no block after them
+
+	return: list of Block
+	'''
+	def get_tips(self, block_hash):
+		tips = []
+		stack = [block_hash]
+		with self.lock:
+			while len(stack) > 0:
+				current = stack.pop()
+				children = self.children.get(current, set())
+				if len(children) == 0 and current in self.blocks:
+					tips.append(self.blocks[current])
+				stack.extend(children)
+		return tips
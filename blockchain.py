@@ -1,3 +1,69 @@
+import config
+from block_store import StoredBlocks
+
+MAX_TARGET = 2**256 - 1
+LOCATOR_RECENT = 10 # hashes of the last blocks in a locator, older ones are exponentially spaced
+
+
+'''
+Get the target that corresponds to config.difficulty: a hash is below 2^(256 - 4 * difficulty)
+exactly when its hex string starts with `difficulty` zeros
+
+return: int
+'''
+def get_initial_target():
+    return min(2**(256 - 4 * config.difficulty), MAX_TARGET)
+
+
+'''
+Get the work a block represents: how many hashes are expected to be tried to find one below its target
+(the genesis block, which has no target, represents none)
+
+return: int
+'''
+def get_work(target):
+    if target == None:
+        return 0
+    return 2**256 // (target + 1)
+
+
+class BranchBlocks:
+
+    '''
+    Initialize the list of blocks of a branch: the blocks of a chain up to a height followed
+    by other blocks, without copying the chain. Used to validate blocks of another branch
+    (and for the hashes of its blocks, see Blockchain.hashes).
+
+    Attributes
+    ----------
+    blocks: list of Block | StoredBlocks
+        blocks of the chain
+    height: int
+        how many blocks of the chain the branch shares
+    branch: list of Block
+        blocks that follow them
+    '''
+    def __init__(self, blocks, height, branch):
+        self.blocks = blocks
+        self.height = height
+        self.branch = branch
+
+    def __len__(self):
+        return self.height + len(self.branch)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[height] for height in range(*item.indices(len(self)))]
+        height = item + len(self) if item < 0 else item
+        if height < self.height:
+            return self.blocks[height]
+        return self.branch[height - self.height]
+
+    def __iter__(self):
+        for height in range(0, len(self)):
+            yield self[height]
+
+
 class Blockchain:
 
     '''
@@ -5,22 +71,274 @@ class Blockchain:
 
     Attributes
     ----------
-    blocks: list of Block
-        the blocks that this blockchain contains
+    blocks: list of Block | StoredBlocks
+        the blocks that this blockchain contains, kept on disk when the blockchain has a store
+    targets: dict
+        cache of retargeted targets, keyed by the hash of the last block before each retarget
+        (so that it stays correct when the chain changes), never sent to other nodes
+    transaction_index: dict
+        transaction id -> (height of its block, position in the block), never sent to other nodes
+    transactions_before: list of int
+        number of transactions in the blocks before each height (and in the whole chain, last),
+        never sent to other nodes
+    chain_work: list of int
+        work of the blocks before each height (and of the whole chain, last), never sent to other nodes
+    block_heights: dict
+        block hash -> height, never sent to other nodes
+    hashes: list of str
+        hash of the block at each height, so that get_target() finds cached targets without
+        reading blocks from the store, never sent to other nodes
+    tip: Block | None
+        the last block, None while the chain is empty
     '''
-    def __init__(self, capacity):
-        self.blocks = []
+    def __init__(self, capacity, store=None):
+        self.blocks = [] if store == None else StoredBlocks(store, config.block_cache)
         self.capacity = capacity
+        self.targets = {}
+        self.index_transactions()
+
+    '''
+    Blocks are always sent as a list, a blockchain received keeps them in memory until use_store()
+    '''
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['blocks'] = list(self.blocks)
+        state['targets'] = {}
+        del state['transaction_index']
+        del state['transactions_before']
+        del state['chain_work']
+        del state['block_heights']
+        del state['hashes']
+        del state['tip']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'targets' not in state:
+            self.targets = {}
+        self.index_transactions()
+
+    '''
+    Build the transaction and block indexes and the cumulative work from the blocks
+    '''
+    def index_transactions(self):
+        self.transaction_index = {}
+        self.transactions_before = [0]
+        self.chain_work = [0]
+        self.block_heights = {}
+        self.hashes = []
+        self.tip = None
+        for height, block in enumerate(self.blocks):
+            self.index_block(height, block)
+
+    '''
+    Add the block at `height` and its transactions to the indexes, a transaction found in more than
+    one block is indexed at the first one
+    '''
+    def index_block(self, height, block):
+        self.block_heights[block.current_hash] = height
+        self.hashes.append(block.current_hash)
+        self.tip = block
+        self.transactions_before.append(self.transactions_before[height] + len(block.transactions))
+        self.chain_work.append(self.chain_work[height] + get_work(block.target))
+        for position, transaction in enumerate(block.transactions):
+            self.transaction_index.setdefault(transaction.transaction_id, (height, position))
 
     '''
     Appends a new block to the list of Block
     '''
     def add_block(self, block):
         self.blocks.append(block)
+        self.index_block(len(self.blocks) - 1, block)
+
+    '''
+    Removes the blocks after the first `length` ones
+    '''
+    def truncate(self, length):
+        for height, block in enumerate(self.blocks[length:], length):
+            if self.block_heights.get(block.current_hash) == height:
+                del self.block_heights[block.current_hash]
+            for transaction in block.transactions:
+                location = self.transaction_index.get(transaction.transaction_id)
+                if location != None and location[0] >= length:
+                    del self.transaction_index[transaction.transaction_id]
+        del self.transactions_before[length + 1:]
+        del self.chain_work[length + 1:]
+        del self.hashes[length:]
+        del self.blocks[length:]
+        self.tip = self.blocks[length - 1] if length > 0 else None
+
+    '''
+    Get where a transaction is in the chain
+
+    return: (int, int) | None
+        height of its block and position in the block, None if it isn't in the chain
+    '''
+    def get_transaction_location(self, transaction_id):
+        return self.transaction_index.get(transaction_id)
+
+    '''
+    Get the hashes that describe this chain to another node so that it can find the last block
+    both have: the last LOCATOR_RECENT blocks, then exponentially further back, and the genesis block
+
+    return: list of str
+        newest first
+    '''
+    def get_locator(self):
+        locator = []
+        height = len(self.blocks) - 1
+        step = 1
+        while height > 0:
+            locator.append(self.blocks[height].current_hash)
+            if len(locator) >= LOCATOR_RECENT:
+                step *= 2
+            height -= step
+        if len(self.blocks) > 0:
+            locator.append(self.blocks[0].current_hash)
+        return locator
+
+    '''
+    Find the last block of this chain that is also in the chain described by a locator
+    (one lookup in the block index per hash of the locator)
+
+    Parameters:
+    -----------
+    locator: list of str
+        see get_locator()
+
+    return: int | None
+        height of the block, None if the chains have nothing in common
+    '''
+    def find_fork(self, locator):
+        fork_height = None
+        for block_hash in locator:
+            height = self.block_heights.get(block_hash)
+            if height != None and (fork_height == None or height > fork_height):
+                fork_height = height
+        return fork_height
+
+    '''
+    Get the height of a block of this chain from its hash
+
+    return: int | None
+        None if the block isn't in the chain
+    '''
+    def get_height(self, block_hash):
+        return self.block_heights.get(block_hash)
+
+    '''
+    Get the headers of the blocks from a height on
+
+    return: list of dict
+        see Block.get_header()
+    '''
+    def get_headers(self, start, count):
+        return [block.get_header() for block in self.blocks[start:start + count]]
+
+    '''
+    Get a blockchain made of the blocks of this one up to a height followed by the blocks of another
+    branch, used to validate that branch (targets depend on the blocks before) before switching to it
+
+    Parameters:
+    -----------
+    height: int
+        how many blocks of this chain the branch shares
+    branch: list of Block
+        blocks that follow them
+
+    return: Blockchain
+    '''
+    def get_branch(self, height, branch):
+        chain = Blockchain(self.capacity)
+        chain.blocks = BranchBlocks(self.blocks, height, branch)
+        chain.hashes = BranchBlocks(self.hashes, height, [block.current_hash for block in branch])
+        chain.tip = chain.blocks[-1] if len(chain.blocks) > 0 else None
+        chain.targets = self.targets
+        return chain
+
+    '''
+    Get how many transactions the chain contains
+
+    return: int
+    '''
+    def count_transactions(self):
+        return self.transactions_before[-1]
+
+    '''
+    Get the work of the blocks up to a height (included), the whole chain by default
+
+    return: int
+    '''
+    def get_chain_work(self, height=None):
+        if height == None:
+            return self.chain_work[-1]
+        return self.chain_work[height + 1]
+
+    '''
+    Move the blocks to a BlockStore (replacing what it contained), from then on
+    only the last config.block_cache blocks used are kept in memory
+
+    Parameters:
+    -----------
+    store: BlockStore
+    '''
+    def use_store(self, store):
+        blocks = list(self.blocks)
+        store.truncate(0)
+        self.blocks = StoredBlocks(store, config.block_cache)
+        for block in blocks:
+            self.blocks.append(block)
 
     def get_transactions(self):
         transactions = []
         for block in self.blocks:
             for transaction in block.transactions:
                 transactions.append(transaction)
-        return transactions
\ No newline at end of file
+        return transactions
+
+    '''
+    Get the median of the timestamps of the config.median_time_blocks blocks before a height.
+    A block must have a later timestamp, so timestamps can't be moved back to lower the difficulty.
+
+    Parameters:
+    -----------
+    height: int
+        index of the block, blocks[0:height] must be its history
+
+    return: float
+    '''
+    def get_median_time(self, height):
+        timestamps = sorted(block.timestamp for block in self.blocks[max(height - config.median_time_blocks, 0):height])
+        return timestamps[len(timestamps) // 2]
+
+    '''
+    Get the target that the hash of the block at `height` must be below, computed only from
+    the blocks before it, so every node agrees on it. Without config.retarget it is always the
+    initial target. Otherwise every config.retarget_interval blocks the previous target is scaled
+    by how long the last interval took compared to config.block_interval seconds per block
+    (at most by a factor of 4 either way).
+
+    Parameters:
+    -----------
+    height: int
+        index of the block, blocks[0:height] must be its history
+
+    return: int
+    '''
+    def get_target(self, height):
+        target = get_initial_target()
+        if not config.retarget:
+            return target
+        interval = config.retarget_interval
+        expected = (interval - 1) * config.block_interval * 1000
+        for period_start in range(interval, height - height % interval + 1, interval):
+            if self.hashes[period_start - 1] in self.targets:
+                target = self.targets[self.hashes[period_start - 1]]
+                continue
+            last = self.blocks[period_start - 1]
+            first = self.blocks[period_start - interval]
+            actual = int((last.timestamp - first.timestamp) * 1000)
+            actual = min(max(actual, expected // 4), expected * 4)
+            target = min(target * actual // expected, MAX_TARGET)
+            self.targets[last.current_hash] = target
+        return target
@@ -1,10 +1,10 @@
-from flask import Flask, request
+from flask import Flask
 from flask_cors import CORS
 from block import Block
 from blockchain import Blockchain
 from transaction_io import Transaction_Output
 from transaction import Transaction
-import config, logging, time, _thread
+import config, logging, os, time, _thread
 from common_functions import *
 
 
@@ -24,14 +24,20 @@ When a node wants to be registered and get an id, it will use this endpoint
 '''
 @app.route('/node/register', methods=['POST'])
 def register_node():
-    node_data = request.json
+    node_data = read_message(ip=str, port=int, public_key=bytes, signature_scheme=str)
+    # every node of the ring must sign with the same scheme
+    if node_data.get('signature_scheme') != node.wallet.scheme.name:
+        response = {'error': "ring uses signature scheme '" + node.wallet.scheme.name + "'"}
+        return response, 400
     node.register_node_to_ring(
         id=node.current_id_count,
         ip=node_data['ip'],
         port=node_data['port'],
-        public_key=jsonpickle.decode(node_data['public_key'])
+        public_key=node_data['public_key'],
+        signature_scheme=node_data['signature_scheme']
     )
     if node.current_id_count == config.nodes:
+        node.save_state()
         _thread.start_new_thread(node.initialize_nodes, ())
         time.sleep(1)
         _thread.start_new_thread(node.worker, ())
@@ -51,15 +57,25 @@ if __name__ == '__main__':
     parser.add_argument('-p', '--port', default=5000, type=int, help='port to listen on')
     args = parser.parse_args()
     port = args.port
-    node.register_node_to_ring(node.id, node.ip, node.port, node.wallet.public_key)
-    blockchain = node.chain
-    genesis = Block(1, 0)
-    first_txn = Transaction(node.wallet.public_key, node.wallet.public_key, 100 * config.nodes, [])
-    first_txn_output = Transaction_Output(first_txn.transaction_id, 0, first_txn.amount)
-    node.UTXOs[0].append(first_txn_output)
-    genesis.add_transaction(first_txn)
-    genesis.current_hash = genesis.myHash()
-    blockchain.add_block(genesis)
-    node.current_block = node.create_new_block(1, 1)
+    if config.block_store != None and node.open_store(os.path.join(config.block_store, str(port))):
+        # restarted: chain, UTXOs and ring come from disk, ask the other nodes for what was missed
+        print("Reloaded chain of " + str(len(node.chain.blocks)) + " blocks")
+        node.begin_working.set()
+        _thread.start_new_thread(node.worker, ())
+        node.catch_up()
+        _thread.start_new_thread(client, ())
+    else:
+        node.register_node_to_ring(node.id, node.ip, node.port, node.wallet.public_key)
+        blockchain = node.chain
+        genesis = Block(1, 0)
+        first_txn = Transaction(node.wallet.address, node.wallet.address, 100 * config.nodes, [])
+        first_txn_output = Transaction_Output(first_txn.transaction_id, 0, first_txn.amount)
+        node.UTXOs.add(first_txn_output)
+        genesis.add_transaction(first_txn)
+        genesis.current_hash = genesis.myHash()
+        blockchain.add_block(genesis)
+        if node.store != None:
+            node.chain.use_store(node.store)
+        node.current_block = node.create_new_block(1, 1)
 
     app.run(host=config.bootstrap_ip, port=port)
\ No newline at end of file
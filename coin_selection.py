@@ -0,0 +1,188 @@
+import threading
+
+BNB_MAX_TRIES = 5000 # steps of the branch and bound search before giving up (it runs under the node's lock)
+
+
+class OldestFirst:
+
+	'''
+	Take outputs in the order they were received until the amount is covered
+	'''
+	name = 'oldest_first'
+
+	def select(self, outputs, amount):
+		selected = []
+		total = 0
+		for output in outputs:
+			if total >= amount:
+				break
+			selected.append(output)
+			total += output.amount
+		return selected if total >= amount else None
+
+
+class LargestFirst:
+
+	'''
+	Take the largest outputs first: as few inputs as possible for every transaction
+	'''
+	name = 'largest_first'
+
+	def select(self, outputs, amount):
+		return OldestFirst().select(sorted(outputs, key=lambda output: output.amount, reverse=True), amount)
+
+
+class BranchAndBound:
+
+	'''
+	Search for a set of outputs that adds up exactly to the amount, so that the transaction
+	has no change output; when there is none, fall back to largest first
+
+	Attributes
+	----------
+	max_tries: int
+		how many steps the search takes before giving up
+	'''
+	name = 'branch_and_bound'
+
+	def __init__(self, max_tries=BNB_MAX_TRIES):
+		self.max_tries = max_tries
+
+	def select(self, outputs, amount):
+		outputs = sorted(outputs, key=lambda output: output.amount, reverse=True)
+		# remaining[i]: sum of outputs[i:], a branch that can't reach the amount with it is cut
+		remaining = [0] * (len(outputs) + 1)
+		for i in range(len(outputs) - 1, -1, -1):
+			remaining[i] = remaining[i + 1] + outputs[i].amount
+		selected = [] # indices of the outputs selected, the branch searched (changed in place)
+		total = 0
+		index = 0 # next output to include or leave out
+		for _ in range(0, self.max_tries):
+			if total == amount:
+				return [outputs[i] for i in selected]
+			if index < len(outputs) and total + remaining[index] >= amount:
+				# the branch with the output first, when it doesn't go over the amount
+				if total + outputs[index].amount <= amount:
+					selected.append(index)
+					total += outputs[index].amount
+				index += 1
+				continue
+			if len(selected) == 0:
+				break
+			# backtrack: leave the last output selected out, and the outputs of the same amount
+			# after it too (they would give the sums already tried)
+			last = selected.pop()
+			total -= outputs[last].amount
+			index = last + 1
+			while index < len(outputs) and outputs[index].amount == outputs[last].amount:
+				index += 1
+		return LargestFirst().select(outputs, amount)
+
+
+class Consolidating:
+
+	'''
+	Largest first, but when the wallet has many outputs, also spend the smallest ones
+	(up to max_inputs in total) so that they are merged into the change output
+
+	Attributes
+	----------
+	threshold: int
+		number of outputs of the wallet above which small outputs are consolidated
+	max_inputs: int
+		most inputs a consolidating transaction can have
+	'''
+	name = 'consolidating'
+
+	def __init__(self, threshold=10, max_inputs=10):
+		self.threshold = threshold
+		self.max_inputs = max_inputs
+
+	def select(self, outputs, amount):
+		selected = LargestFirst().select(outputs, amount)
+		if selected == None or len(outputs) <= self.threshold:
+			return selected
+		chosen = set(id(output) for output in selected)
+		for output in sorted(outputs, key=lambda output: output.amount):
+			if len(selected) >= self.max_inputs:
+				break
+			if id(output) not in chosen:
+				selected.append(output)
+		return selected
+
+
+STRATEGIES = [OldestFirst, LargestFirst, BranchAndBound, Consolidating]
+
+
+'''
+Get a coin selection strategy by name (config.coin_selection)
+
+return: OldestFirst | LargestFirst | BranchAndBound | Consolidating
+'''
+def get_strategy(name):
+	for strategy in STRATEGIES:
+		if strategy.name == name:
+			return strategy()
+	raise ValueError("Unknown coin selection strategy '" + str(name) + "'")
+
+
+class SelectionStats:
+
+	'''
+	Initialize counters of the inputs chosen for the transactions of a wallet
+
+	Attributes
+	----------
+	transactions: int
+		transactions whose inputs were selected
+	inputs: int
+		inputs selected in total
+	max_inputs: int
+		most inputs selected for a single transaction
+	outputs: int
+		outputs the wallet had to choose from, in total
+	failed: int
+		selections that couldn't cover the amount
+	'''
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.transactions = 0
+		self.inputs = 0
+		self.max_inputs = 0
+		self.outputs = 0
+		self.failed = 0
+
+	'''
+	Record a selection
+
+	Parameters:
+	-----------
+	inputs: int | None
+		number of inputs selected, None if the selection failed
+	outputs: int
+		number of outputs the wallet had
+	'''
+	def record(self, inputs, outputs):
+		with self.lock:
+			if inputs == None:
+				self.failed += 1
+				return
+			self.transactions += 1
+			self.inputs += inputs
+			self.max_inputs = max(self.max_inputs, inputs)
+			self.outputs += outputs
+
+	'''
+	return: dict
+	'''
+	def get_stats(self):
+		with self.lock:
+			stats = dict(
+				transactions = self.transactions,
+				failed = self.failed,
+				max_inputs = self.max_inputs
+			)
+			if self.transactions > 0:
+				stats['average_inputs'] = self.inputs / self.transactions
+				stats['average_wallet_outputs'] = self.outputs / self.transactions
+			return stats
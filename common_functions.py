@@ -1,21 +1,70 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, abort, jsonify, request
+from werkzeug.serving import WSGIRequestHandler
 from node import Node
+from block import Block
 from blockchain import Blockchain
+from transaction import Transaction
 from config import DEBUG, bootstrap_ip
-import config, copy, jsonpickle, time, _thread
+import config, copy, jsonpickle, time
+import wire
 
 node = Node(bootstrap_ip, 5000, 0)
 
 
 rest = Blueprint('rest', __name__)
+# keep connections from other nodes open between requests (see peers.PeerClient)
+WSGIRequestHandler.protocol_version = "HTTP/1.1"
 blockchain = Blockchain(config.capacity) 
 
 
 #.......................................................................................
 
+'''
+Read a message sent by another node: binary (see wire), or JSON with every field encoded with jsonpickle
+only when config.wire_format is 'json' (jsonpickle can create any object, so a binary node never decodes it).
+A message that can't be decoded or lacks a field is answered with 400, a JSON message to a binary node with 415.
+
+Parameters:
+-----------
+fields: type
+    the type every field the message must have has, e.g. read_message(block=Block)
+
+return: dict
+'''
+def read_message(**fields):
+    if request.content_type != wire.CONTENT_TYPE and config.wire_format != 'json':
+        abort(415)
+    try:
+        if request.content_type == wire.CONTENT_TYPE:
+            message = wire.decode(request.get_data())
+        else:
+            message = {key: jsonpickle.decode(value) for key, value in request.json.items()}
+    except ValueError:
+        abort(400)
+    if type(message) != dict or any(type(message.get(field)) != cls for field, cls in fields.items()):
+        abort(400)
+    return message
+
+'''
+Answer another node in binary (see wire) if it accepts it, otherwise in JSON with
+the fields that are objects encoded with jsonpickle
+
+Parameters:
+-----------
+message: dict
+    the fields of the response
+encoded: tuple of str
+    fields that are objects
+'''
+def send_message(message, encoded):
+    if wire.CONTENT_TYPE in request.accept_mimetypes.values():
+        return Response(wire.encode(message), mimetype=wire.CONTENT_TYPE), 200
+    for field in encoded:
+        message[field] = jsonpickle.encode(message[field])
+    return jsonify(message), 200
+
 def client():
-    while not node.begin_working:
-        pass
+    node.begin_working.wait()
     print("\n        NBC Client        \n")
     while(True):        
         print(">", end=" ")
@@ -31,13 +80,8 @@ def client():
 
             # validate first argument
             recipient_address = cli_input[0]
-            flag = False
-            for n in node.ring:
-                if n['id'] == node.id: # skip self
-                    continue
-                if n['ip'] + ":" + str(n['port']) == recipient_address:
-                    flag = True
-            if not flag:
+            recipient = node.ring.get_by_endpoint(recipient_address)
+            if recipient == None or recipient['id'] == node.id: # skip self
                 print("'" + recipient_address + "' is not valid address.\n")
                 continue
             
@@ -49,8 +93,7 @@ def client():
                 continue
             amount = int(cli_input[1])
 
-            while node.lock.acquire(blocking=False):
-                pass
+            node.lock.acquire()
 
             # validate amount
             temp = node.get_transaction_inputs(amount)
@@ -62,7 +105,7 @@ def client():
                     node.lock.release()
                 continue
 
-            if node.mining:
+            if not node.mining_done.is_set():
                 print("\nNow mining, will process later.")
 
             inputs, inputs_sum = temp
@@ -91,8 +134,8 @@ def client():
             print()
         elif cli_input == "balances":
             print("Balances requested")
-            for i in range(0, config.nodes):
-                print("Wallet: " + str(node.get_wallet_balance(i)) + " NBC")
+            for balance in node.get_wallet_balances():
+                print("Wallet: " + str(balance) + " NBC")
             print()
         elif cli_input == "chain":
             print("Chain hashes requested")
@@ -112,17 +155,15 @@ def client():
 
 
 def simulation():
-    while not node.begin_working:
-        pass
+    node.begin_working.wait()
 
     node.simulation_start_time = time.time()
     file = open("transactions/" + str(config.nodes) + "nodes/transactions" + str(node.id) + ".txt", "r")
     for line in file:
-        if node.mining:
+        if not node.mining_done.is_set():
             if DEBUG:
                 print("Sim-mining")
-        while node.mining:
-            pass
+        node.mining_done.wait()
         id, amount = line.split(" ")
         id = int(id[-1])
         amount = int(amount)
@@ -133,8 +174,10 @@ def simulation():
             print()
             print("Before acquiring lock in simulation")
 
-        while not((len(node.pending_transactions) < config.capacity) and (node.lock.acquire(blocking=False))):
-            pass
+        # let the worker catch up before adding more
+        while len(node.pending_transactions) >= config.capacity:
+            time.sleep(0.01)
+        node.lock.acquire()
 
         if DEBUG:
             print("Acquired lock in simulation")
@@ -173,16 +216,11 @@ After mining process, when a block is found, it is sent to this endpoint
 def add_block():
     if DEBUG:
         print("Received a block with txns:")
-    block_received = jsonpickle.decode(request.json['block'])
+    block_received = read_message(block=Block)['block']
     if DEBUG:
         for transaction in block_received.transactions:
-            sender_id = None
-            receiver_id = None
-            for item in node.ring:
-                if item["public_key"] == transaction.sender_address:
-                    sender_id = item["id"]
-                if item["public_key"] == transaction.receiver_address:
-                    receiver_id = item["id"]
+            sender_id = node.ring.get_id(transaction.sender_address)
+            receiver_id = node.ring.get_id(transaction.receiver_address)
             print("Sender: " + str(sender_id) + ", Receiver: " + str(receiver_id) + ", amount: " + str(transaction.amount))
             for t_input in transaction.transaction_inputs:
                 print("\tInput: { Owner: " + str(t_input.owner) + ", Amount: " + str(t_input.amount) + " }")
@@ -191,18 +229,8 @@ def add_block():
         print()
         print("Incoming block with hash: " + str(block_received.current_hash))
         print("Prev: " + str(block_received.previous_hash))
-        print("Curr: " + str(node.chain.blocks[-1].current_hash))
-    while node.received_block:
-        pass
-    node.received_block = True
-    correct_block = node.validate_block(block_received)
-    if correct_block:
-        node.block_received = block_received
-    else:
-        node.received_block = False
-        if not node.resolving_conflicts:
-            node.resolving_conflicts = True
-            _thread.start_new_thread(node.resolve_conflicts, ())
+        print("Curr: " + str(node.chain.tip.current_hash))
+    node.receive_block(block_received)
     return "OK", 200
 
 
@@ -211,8 +239,8 @@ When a transaction is created and broadcasted, it will be received in this endpo
 '''
 @rest.route('/transaction/receive', methods=['POST'])
 def receive_transaction():
-    transaction = request.json['transaction']
-    transaction = jsonpickle.decode(transaction)
+    transaction = read_message(transaction=Transaction)['transaction']
+    node.verifier.submit(transaction) # verify in the background, worker will find it in the cache
     node.pending_transactions.append(transaction)
     return "OK", 200
 
@@ -231,17 +259,100 @@ Get balance of current node [unused by client, can be used in Postman]
 '''
 @rest.route('/balance', methods=['GET'])
 def balance():
-    balance = node.get_wallet_balance()
+    balance = node.get_wallet_balance(node.id)
     response = {'balance': jsonpickle.encode(balance)}
     return jsonify(response), 200
 
+'''
+Get balances of all wallets, by node id [unused by client, can be used in Postman]
+'''
+@rest.route('/balances', methods=['GET'])
+def balances():
+    balances = node.get_wallet_balances()
+    response = {'balances': jsonpickle.encode(balances)}
+    return jsonify(response), 200
+
+'''
+Get the Merkle inclusion proof of a transaction in the chain, with the full header of its block,
+so that a light client can check the header hash (see block.get_header_hash) and verify the proof
+against its Merkle root only (see merkle.verify_proof)
+'''
+@rest.route('/transaction/proof/<txid>', methods=['GET'])
+def get_transaction_proof(txid):
+    # the transaction index gives its block, only that block is read
+    location = node.chain.get_transaction_location(txid)
+    if location == None:
+        return jsonify({'error': 'transaction not found'}), 404
+    block = node.chain.blocks[location[0]]
+    leaf, proof = block.get_proof(txid)
+    response = {
+        'header': block.get_header(),
+        'leaf': leaf,
+        'proof': proof
+    }
+    return jsonify(response), 200
+
+'''
+Get how long each mining cancellation (block received/resolving conflicts) took to take effect
+and how much mining work was wasted
+'''
+@rest.route('/mining/cancellations', methods=['GET'])
+def get_mining_cancellations():
+    return jsonify(node.interrupt.get_stats()), 200
+
+'''
+Get how many inputs the coin selection strategy chose per transaction and the size of the UTXO set
+'''
+@rest.route('/utxos/stats', methods=['GET'])
+def get_utxo_stats():
+    return jsonify(node.get_selection_stats()), 200
+
+'''
+Get how many requests this node sent to the other nodes and how many connections it created
+for them or reused, per node and in total
+'''
+@rest.route('/peers/stats', methods=['GET'])
+def get_peer_stats():
+    return jsonify(node.peers.get_stats()), 200
+
+'''
+Endpoint used when resolving conflicts: find the last block in common with the chain described by
+the locator (comma separated hashes, see Blockchain.get_locator()) and give the headers of up to
+config.sync_headers blocks after it, with the length of the chain and the current block
+'''
+@rest.route('/chain/headers', methods=['GET'])
+def get_chain_headers():
+    locator = request.args.get('locator', '').split(',')
+    fork_height = node.chain.find_fork(locator)
+    headers = []
+    if fork_height != None:
+        headers = node.chain.get_headers(fork_height + 1, config.sync_headers)
+    response = {
+        'length': len(node.chain.blocks),
+        'work': node.chain.get_chain_work(),
+        'fork_height': fork_height,
+        'headers': headers,
+        'current_block': node.current_block
+    }
+    return send_message(response, ('current_block',))
+
+'''
+Endpoint used when resolving conflicts, give up to config.sync_batch blocks from a height on
+'''
+@rest.route('/chain/blocks', methods=['GET'])
+def get_chain_blocks():
+    start = int(request.args.get('start', 0))
+    count = min(int(request.args.get('count', config.sync_batch)), config.sync_batch)
+    response = {'blocks': node.chain.blocks[start:start + count]}
+    return send_message(response, ('blocks',))
+
 '''
 Endpoint used when resolving conflicts, give chain (and other info) to update node that asks for it
 '''
 @rest.route('/chain/get', methods=['GET'])
 def get_chain():
     response = {
-        'chain': jsonpickle.encode(copy.deepcopy(node.chain)),
-        'current_block': jsonpickle.encode(node.current_block)
+        'chain': copy.deepcopy(node.chain),
+        'current_block': node.current_block
     }
-    return jsonify(response), 200
+    return send_message(response, ('chain', 'current_block'))
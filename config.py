@@ -3,4 +3,28 @@ capacity=5
 difficulty=4
 simulation=False
 bootstrap_ip = '192.168.0.7'
-DEBUG=False
\ No newline at end of file
+DEBUG=False
+mining_processes=1
+retarget=False
+retarget_interval=10
+block_interval=10
+verification_workers=4
+signature_cache_size=100000
+signature_scheme='rsa'
+signature_key_size=4096
+coin_selection='branch_and_bound'
+block_store=None
+block_cache=100
+undo_depth=100
+sync_headers=2000
+sync_batch=50
+peer_timeout=5
+sync_quorum=None
+side_blocks=100
+wire_format='binary'
+peer_pool_size=4
+peer_retries=2
+peer_backoff=0.1
+median_time_blocks=11
+max_future_drift=60
+utxo_snapshot_interval=10
\ No newline at end of file
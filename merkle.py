@@ -0,0 +1,109 @@
+import hashlib
+
+# prefixes that keep leaves and inner nodes apart, so that an inner node can never pass as a leaf
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+'''
+Hash the canonical encoding of a transaction into a leaf of the tree
+
+Parameters:
+-----------
+data: bytes
+	encoded transaction
+
+return: str
+	hex digest of the leaf
+'''
+def leaf_hash(data):
+	return hashlib.sha256(LEAF_PREFIX + data).hexdigest()
+
+
+'''
+Hash two sibling nodes into their parent
+
+return: str
+	hex digest of the parent
+'''
+def node_hash(left, right):
+	return hashlib.sha256(NODE_PREFIX + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+'''
+Build a Merkle tree bottom-up. When a level has an odd number of nodes,
+the last one is promoted to the next level as it is (pairing it with itself would give
+[a, b, c] and [a, b, c, c] the same root).
+
+Parameters:
+-----------
+leaves: list of str
+	leaf hashes (see leaf_hash()), in the order of the block's transactions
+
+return: list of list of str
+	levels of the tree, leaves first and root last
+'''
+def build_tree(leaves):
+	if len(leaves) == 0:
+		return [[hashlib.sha256(b"").hexdigest()]]
+	levels = [list(leaves)]
+	while len(levels[-1]) > 1:
+		level = levels[-1]
+		parents = []
+		for i in range(0, len(level) - 1, 2):
+			parents.append(node_hash(level[i], level[i+1]))
+		if len(level) % 2 == 1:
+			parents.append(level[-1])
+		levels.append(parents)
+	return levels
+
+
+'''
+Get the inclusion proof of a leaf: the sibling of every node on its path to the root
+(a node promoted without a sibling adds nothing)
+
+Parameters:
+-----------
+levels: list of list of str
+	tree returned by build_tree()
+index: int
+	position of the leaf
+
+return: list of [str, str]
+	pairs of sibling hash and the side ('left' or 'right') it is on
+'''
+def get_proof(levels, index):
+	proof = []
+	for level in levels[:-1]:
+		if index % 2 == 0:
+			if index + 1 < len(level):
+				proof.append([level[index+1], 'right'])
+		else:
+			proof.append([level[index-1], 'left'])
+		index //= 2
+	return proof
+
+
+'''
+Verify an inclusion proof against a Merkle root, without needing any other transaction
+
+Parameters:
+-----------
+leaf: str
+	leaf hash of the transaction
+proof: list of [str, str]
+	proof returned by get_proof()
+root: str
+	Merkle root found in the block header
+
+return: bool
+	whether the leaf is part of the tree with that root
+'''
+def verify_proof(leaf, proof, root):
+	current = leaf
+	for sibling, side in proof:
+		if side == 'left':
+			current = node_hash(sibling, current)
+		else:
+			current = node_hash(current, sibling)
+	return current == root
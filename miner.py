@@ -0,0 +1,262 @@
+import hashlib, multiprocessing
+import threading, time
+from collections import deque
+from random import randint
+
+NONCE_SPACE = 2**64
+CHECK_INTERVAL = 1024 # nonces tried between two checks of the job generation
+CANCELLATIONS_KEPT = 100 # how many cancellations MiningInterrupt remembers
+
+
+'''
+Loop run by every worker process: waits for a job, searches its own slice of the nonce
+space and reports the first valid nonce found. A worker abandons its job as soon as the
+shared generation counter no longer matches the job's id (solution found or job cancelled).
+
+Parameters:
+-----------
+worker_index: int
+	position of this worker in the pool, decides which slice of the nonce space it searches
+workers: int
+	size of the pool
+jobs: Queue
+	queue where this worker receives (job_id, header_prefix, target, start) tuples, None to exit
+results: Queue
+	queue shared by all workers to report (job_id, nonce, hash) tuples
+generation: Value
+	id of the job currently being searched
+attempts: Array
+	number of nonces tried by each worker, used to measure wasted work
+'''
+def search_nonces(worker_index, workers, jobs, results, generation, attempts):
+	span = NONCE_SPACE // workers
+	while True:
+		job = jobs.get()
+		if job == None:
+			return
+		job_id, header_prefix, target, start = job
+		header = hashlib.sha256(header_prefix)
+		target = target.to_bytes(32, 'big') # digests compare like the numbers they encode
+		nonce = (start + worker_index * span) % NONCE_SPACE
+		while generation.value == job_id:
+			for _ in range(CHECK_INTERVAL):
+				attempt = header.copy()
+				attempt.update(nonce.to_bytes(8, 'big'))
+				if attempt.digest() < target:
+					results.put((job_id, nonce, attempt.hexdigest()))
+					break
+				nonce = (nonce + 1) % NONCE_SPACE
+			else:
+				attempts[worker_index] += CHECK_INTERVAL
+				continue
+			break
+
+
+class MiningInterrupt:
+
+	'''
+	Initialize the signal that stops mining as soon as a block is received or conflicts start
+	being resolved. It wraps a threading.Event (checked by the single-threaded miner) and calls
+	its listeners when raised (used to wake the thread waiting on the pool of mining processes).
+
+	Attributes
+	----------
+	event: Event
+		set while mining must not go on
+	reason: str
+		why the interrupt was raised
+	raised_at: float
+		time.perf_counter() when the interrupt was raised, None after the miner acknowledged it
+	listeners: list of function
+		called (without arguments) every time the interrupt is raised
+	cancellations: deque of dict
+		last cancellations: reason, latency until the miner stopped, mining time and attempts wasted
+	'''
+	def __init__(self):
+		self.event = threading.Event()
+		self.lock = threading.Lock()
+		self.reason = None
+		self.raised_at = None
+		self.listeners = []
+		self.cancellations = deque(maxlen=CANCELLATIONS_KEPT)
+
+	'''
+	Raise the interrupt and wake everyone waiting on it
+
+	Parameters:
+	-----------
+	reason: str
+		why mining has to stop, kept in the cancellation statistics
+	'''
+	def trigger(self, reason):
+		with self.lock:
+			if self.event.is_set():
+				return
+			self.reason = reason
+			self.raised_at = time.perf_counter()
+			self.event.set()
+			listeners = list(self.listeners)
+		for listener in listeners:
+			listener()
+
+	def is_set(self):
+		return self.event.is_set()
+
+	def clear(self):
+		with self.lock:
+			self.event.clear()
+			self.raised_at = None
+
+	def add_listener(self, listener):
+		with self.lock:
+			self.listeners.append(listener)
+
+	def remove_listener(self, listener):
+		with self.lock:
+			self.listeners.remove(listener)
+
+	'''
+	Called by the miner when it has stopped because of the interrupt, records how long
+	the cancellation took to take effect and how much mining work was thrown away
+
+	Parameters:
+	-----------
+	mining_time: float
+		seconds spent mining the block before it was cancelled
+	attempts: int
+		nonces tried before the cancellation
+	'''
+	def acknowledge(self, mining_time, attempts):
+		with self.lock:
+			if self.raised_at == None:
+				return
+			self.cancellations.append(dict(
+				reason = self.reason,
+				latency_ms = (time.perf_counter() - self.raised_at) * 1000,
+				mining_time = mining_time,
+				attempts = attempts
+			))
+			self.raised_at = None
+
+	'''
+	Get the cancellations recorded and their averages
+
+	return: dict
+	'''
+	def get_stats(self):
+		with self.lock:
+			cancellations = list(self.cancellations)
+		stats = dict(count = len(cancellations), cancellations = cancellations)
+		if len(cancellations) > 0:
+			stats['average_latency_ms'] = sum(item['latency_ms'] for item in cancellations) / len(cancellations)
+			stats['average_mining_time'] = sum(item['mining_time'] for item in cancellations) / len(cancellations)
+			stats['average_attempts'] = sum(item['attempts'] for item in cancellations) / len(cancellations)
+		return stats
+
+
+class Miner:
+
+	'''
+	Initialize a pool of worker processes that search for a block's nonce in parallel
+
+	Attributes
+	----------
+	processes: int
+		number of worker processes, each one searches 1/processes of the nonce space
+	generation: Value
+		id of the job currently being searched, changing it stops every worker
+	jobs: list of Queue
+		one queue per worker, used to hand out jobs
+	results: Queue
+		queue where workers report solutions, None is put in it to wake the waiting thread
+	attempts: Array
+		nonces tried by each worker since it was started
+	last_attempts: int
+		nonces tried during the last search (approximately, counted every CHECK_INTERVAL)
+	workers: list of Process
+		the worker processes, started immediately (before the node starts any threads)
+	'''
+	def __init__(self, processes):
+		if 'fork' in multiprocessing.get_all_start_methods():
+			context = multiprocessing.get_context('fork')
+		else:
+			context = multiprocessing.get_context()
+		self.processes = processes
+		self.generation = context.Value('Q', 0, lock=False)
+		self.jobs = [context.Queue() for _ in range(processes)]
+		self.results = context.Queue()
+		self.attempts = context.Array('Q', processes, lock=False)
+		self.last_attempts = 0
+		self.workers = []
+		for i in range(0, processes):
+			worker = context.Process(
+				target=search_nonces,
+				args=(i, processes, self.jobs[i], self.results, self.generation, self.attempts),
+				daemon=True
+			)
+			worker.start()
+			self.workers.append(worker)
+
+	'''
+	Search for a nonce that gives a block header a hash below the target.
+	Every worker gets a different slice of the nonce space, starting from a random point.
+	The calling thread sleeps until a worker reports a solution or the interrupt is raised.
+
+	Parameters:
+	-----------
+	header_prefix: bytes
+		header of the sealed block without its nonce (Block.header_prefix())
+	target: int
+		the hash, as a number, must be below it
+	interrupt: MiningInterrupt
+		when raised, the search is cancelled immediately
+
+	return: (int, str) | None
+		nonce and hash found, or None if the search was interrupted
+	'''
+	def search(self, header_prefix, target, interrupt):
+		interrupt.add_listener(self.wake)
+		try:
+			attempts = sum(self.attempts)
+			job_id = self.generation.value + 1
+			self.generation.value = job_id
+			start = randint(0, NONCE_SPACE - 1)
+			if interrupt.is_set():
+				return None
+			for jobs in self.jobs:
+				jobs.put((job_id, header_prefix, target, start))
+			while True:
+				result = self.results.get()
+				if result == None: # woken up by the interrupt (maybe a late wake-up of a previous search)
+					if interrupt.is_set():
+						return None
+					continue
+				if result[0] == job_id: # ignore late solutions of cancelled jobs
+					return result[1], result[2]
+		finally:
+			self.cancel()
+			interrupt.remove_listener(self.wake)
+			self.last_attempts = sum(self.attempts) - attempts
+
+	'''
+	Wake the thread waiting in search(), called when the interrupt is raised
+	'''
+	def wake(self):
+		self.cancel()
+		self.results.put(None)
+
+	'''
+	Stop every worker, by moving the generation past the job being searched
+	'''
+	def cancel(self):
+		self.generation.value += 1
+
+	'''
+	Terminate the worker processes
+	'''
+	def shutdown(self):
+		self.cancel()
+		for jobs in self.jobs:
+			jobs.put(None)
+		for worker in self.workers:
+			worker.join()
@@ -1,17 +1,31 @@
-import copy
+import hashlib
+import os
 import time
 from random import randint
 import jsonpickle
-from collections import deque
-from block import Block
-from blockchain import Blockchain
+from collections import deque, OrderedDict
+from block import Block, get_header_hash
+from blockchain import Blockchain, get_work
+from block_store import BlockStore
+from block_tree import BlockTree
 from transaction import Transaction
 from transaction_io import Transaction_Input, Transaction_Output
+from utxo import UTXOSet
 from wallet import Wallet
-import requests
+from ring import Ring
+from miner import Miner, MiningInterrupt
+from verification import SignatureVerifier
+from coin_selection import SelectionStats, get_strategy
+from peers import PeerClient
+from requests.exceptions import RequestException
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import config
 from config import DEBUG
-import threading
+import threading, _thread
+import signature
+import wire
+
+IDLE_WAIT = 0.01 # seconds the worker sleeps between looking for new transactions when it has none
 
 class Node:
 
@@ -28,57 +42,99 @@ class Node:
 		number that represents a node (0, ..., n-1)
 	current_id_count: int
 		how many nodes exist - basically size of ring
-	UTXOs: list of list of Transaction_Output
-		list of UTXOs for each node
-	pending_UTXOs: list of list of Transaction_Output
-		temporary changes made to UTXOs while making transactions:
-			- in case a block is mined they are copied to UTXOs
-			- in case a block is received they are discarded and are then brought up to date with the changes received
+	UTXOs: UTXOSet
+		unspent outputs of every node, indexed by outpoint and by owner
+	pending_UTXOs: UTXOOverlay
+		temporary changes made to UTXOs while making transactions, kept on top of UTXOs:
+			- in case a block is mined they are committed to UTXOs
+			- in case a block is received they are discarded, UTXOs are brought up to date with the changes received
+	undo_records: OrderedDict
+		block hash -> outputs spent and created when the block was connected, used to disconnect it
+		on a reorg (kept for the last config.undo_depth blocks)
+	store: BlockStore | None
+		where the chain is kept on disk (config.block_store), None when it is kept in memory only
+	side_blocks: BlockTree
+		blocks received that aren't in chain: side branches this node may switch to and orphans
+		(config.side_blocks at most)
+	current_block_transactions: (Block, dict)
+		current_block and the positions of its transactions by id (see get_current_block_transactions())
+	peer_requests: ThreadPoolExecutor
+		threads used to ask the other nodes for their chain at the same time when resolving conflicts
+	peers: PeerClient
+		keep-alive connections to the other nodes, used for all requests to them
 	wallet: Wallet
 		the Wallet object of this node
 	ip: str
 		string that represents the ip of this node, used with port
 	port: int
 		number that represents the port that this node lists node, used with ip
-	ring: list of dict
+	ring: Ring
 		here we store information for every node, as its id, its address (ip:port) its public key
-	received_block: bool
-		boolean that signifies whether a block was received, useful for stopping the mining process
+		and the short address of its wallet (used in transactions instead of the public key),
+		indexed by wallet address, id and ip:port
+	received_block: Event
+		set while a valid block received is waiting to be processed, useful for stopping the mining process
 	block_received: Block
 		Block object that is set in endpoint when a block is received
-	mining: bool
-		boolean that signifies whether this node is currently mining
+	block_slot: Condition
+		condition used by endpoint /block/add to wait until the previous block received has been processed
+	mining_done: Event
+		set while this node isn't mining, waited on before changing current_block
 	pending_transactions: deque of Transaction
 		deque that holds all transactions to be processed, both incoming and self-generated
 	lock: Lock
 		lock to use when accessing critical sections in code, 
 		between transactions created in simulation/client, processed in worker and when resolving conflicts
-	begin_working: bool
-		boolean that is set after first transactions for 100 NBC are performed
+	begin_working: Event
+		set after first transactions for 100 NBC are performed
 	simulation_start_time: time
 		time object to use for simulations
-	resolving_conflicts: bool
-		boolean to use when resolving conflicts
+	resolving_conflicts: Event
+		set while resolving conflicts
+	interrupt: MiningInterrupt
+		raised together with received_block/resolving_conflicts, stops mining immediately
+	miner: Miner | None
+		pool of processes used to search for nonces in parallel, None when mining in a single thread
+	verifier: SignatureVerifier
+		verifies transaction signatures on a thread pool and remembers the ones already verified
+	coin_selection: OldestFirst | LargestFirst | BranchAndBound | Consolidating
+		strategy used to choose the UTXOs spent by the transactions of this node (config.coin_selection)
+	selection_stats: SelectionStats
+		inputs chosen for the transactions of this node
 	'''
 	def __init__(self, ip, port, id):
 		self.chain = Blockchain(config.capacity)
 		self.current_block = Block(-1, -1)
 		self.id = id
 		self.current_id_count = id # will be updated in main
-		self.UTXOs = []
-		self.pending_UTXOs = []
+		self.UTXOs = UTXOSet()
+		self.pending_UTXOs = self.UTXOs.overlay()
+		self.undo_records = OrderedDict()
+		self.store = None
+		self.side_blocks = BlockTree(config.side_blocks)
+		self.current_block_transactions = (None, {})
+		self.peer_requests = ThreadPoolExecutor(max_workers=max(config.nodes - 1, 1))
+		# every thread of peer_requests may be talking to the same node, each needs its own connection
+		self.peers = PeerClient(config.nodes, max(config.peer_pool_size, config.nodes - 1), config.peer_timeout, config.peer_retries, config.peer_backoff)
 		self.wallet = self.generate_wallet()
 		self.ip = ip
 		self.port = port
-		self.ring = []
-		self.received_block = False
+		self.ring = Ring()
+		self.received_block = threading.Event()
 		self.block_received = None
-		self.mining = False
+		self.block_slot = threading.Condition()
+		self.mining_done = threading.Event()
+		self.mining_done.set()
 		self.pending_transactions = deque()
 		self.lock = threading.Lock()
-		self.begin_working = False
+		self.begin_working = threading.Event()
 		self.simulation_start_time = None
-		self.resolving_conflicts = False
+		self.resolving_conflicts = threading.Event()
+		self.interrupt = MiningInterrupt()
+		self.miner = Miner(config.mining_processes) if config.mining_processes > 1 else None
+		self.verifier = SignatureVerifier(config.verification_workers, config.signature_cache_size, self.get_public_key)
+		self.coin_selection = get_strategy(config.coin_selection)
+		self.selection_stats = SelectionStats()
 		
 
 	'''
@@ -88,16 +144,15 @@ class Node:
 	def worker(self):
 		while True:
 			# wait until conflicts are resolved
-			while self.resolving_conflicts:
-				pass
+			with self.block_slot:
+				self.block_slot.wait_for(lambda: not self.resolving_conflicts.is_set())
 			# while there are no pending transactions, only perform
 			# changes if a correct block is received
 			while len(self.pending_transactions) == 0:
-				if self.received_block:
+				if self.received_block.is_set():
 					if DEBUG:
 						print("Have received a block while working - trying to lock")
-					while not self.lock.acquire(blocking=False):
-						pass
+					self.lock.acquire()
 					if DEBUG:
 						print("Acquired lock in worker")
 					if self.block_received == None and self.lock.locked():
@@ -105,25 +160,23 @@ class Node:
 						continue
 					if self.validate_block(self.block_received):
 						self.process_block_received()
-					self.received_block = False
-					self.mining = False
-					self.block_received = None
+					self.mining_done.set()
+					self.release_received_block()
 					if self.lock.locked():
 						self.lock.release()
 					continue
-				pass
-			while not self.lock.acquire(blocking=False):
-				pass
+				# sleeps until a block is received, transactions added are seen within IDLE_WAIT seconds
+				self.received_block.wait(IDLE_WAIT)
+			self.lock.acquire()
 			if DEBUG:
 				print("Acquired lock in worker")
-			if self.received_block:
+			if self.received_block.is_set():
 				if DEBUG:
 					print("Have received a block while working - already locked")
 				if self.validate_block(self.block_received):
 					self.process_block_received()
-				self.received_block = False
-				self.mining = False
-				self.block_received = None
+				self.mining_done.set()
+				self.release_received_block()
 				if self.lock.locked():
 					self.lock.release()
 				continue
@@ -135,7 +188,7 @@ class Node:
 				continue
 
 			# if transaction is created by current node 'recreate' it
-			if transaction.sender_address == self.wallet.public_key:
+			if transaction.sender_address == self.wallet.address:
 				transaction = self.recreate_node_transaction(transaction)
 			
 			# if transaction already exists in chain, it's duplicate, do nothing
@@ -146,12 +199,11 @@ class Node:
 
 			if DEBUG:
 				print("Trying to validate txn in worker")
-			while self.mining:
-				pass
+			self.mining_done.wait()
 			valid_transaction = self.validate_transaction(transaction)
 			if valid_transaction:
 				# if transaction is correct and by current node, also broadcast
-				if transaction.sender_address == self.wallet.public_key:
+				if transaction.sender_address == self.wallet.address:
 					self.broadcast_transaction(transaction)
 				if DEBUG:
 					print("Now processing pending transaction...")
@@ -164,26 +216,32 @@ class Node:
 
 
 	'''
-	Get balance of a wallet in a node by adding its UTXOs
+	Get balance of a wallet in a node from the running totals of its UTXOs
 	that exist in current node (every node is always up to date)
 
 	Parameters:
 	-----------
 	id: int
-		the id of the node in order to search UTXOs (list of list of Transaction_Output)
+		the id of the node in order to search UTXOs (UTXOSet, indexed by owner)
+	pending: bool
+		whether to include the changes of transactions that are not in a block yet
 
 	return: int
 		the amount of NBC in a node
 	'''
 	def get_wallet_balance(self, id, pending=True):
-		sum = 0
 		if pending:
-			for utxo in self.pending_UTXOs[id]:
-				sum += utxo.amount
-		else:
-			for utxo in self.UTXOs[id]:
-				sum += utxo.amount
-		return sum
+			return self.pending_UTXOs.get_balance(id)
+		return self.UTXOs.get_balance(id)
+
+	'''
+	Get balances of all wallets of the ring
+
+	return: list of int
+		the amount of NBC in every node, by id
+	'''
+	def get_wallet_balances(self, pending=True):
+		return [self.get_wallet_balance(node['id'], pending) for node in self.ring]
 
 	'''
 	For debugging purposes
@@ -220,24 +278,31 @@ class Node:
 		returns 'index' of transaction
 	'''
 	def get_transactions_number(self, transaction_id):
-		counter = 0
-		flag = False
-		for block in self.chain.blocks:
-			for transaction in block.transactions:
-				if transaction.transaction_id == transaction_id:
-					flag = True
-					break
-				else:
-					counter += 1
-			if flag:
-				return counter
-		for transaction in self.current_block.transactions:
-			if transaction.transaction_id == transaction_id:
-				flag = True
-				break
-			else:
-				counter += 1
-		return counter
+		location = self.chain.get_transaction_location(transaction_id)
+		if location != None:
+			height, position = location
+			return self.chain.transactions_before[height] + position
+		counter = self.chain.count_transactions()
+		position = self.get_current_block_transactions().get(transaction_id)
+		if position != None:
+			return counter + position
+		return counter + len(self.current_block.transactions)
+
+	'''
+	Get the positions of the transactions of current_block by id. They are indexed as they are
+	added to it (transactions are only ever appended) and again when current_block is replaced.
+
+	return: dict
+		transaction id -> position in current_block
+	'''
+	def get_current_block_transactions(self):
+		block, positions = self.current_block_transactions
+		if block is not self.current_block:
+			block, positions = self.current_block, {}
+			self.current_block_transactions = (block, positions)
+		for position in range(len(positions), len(block.transactions)):
+			positions.setdefault(block.transactions[position].transaction_id, position)
+		return positions
 
 	'''
 	Get info on whether a transaction exists in chain or in current_block
@@ -251,17 +316,10 @@ class Node:
 		true if it exists, false if it doesn't
 	'''
 	def transaction_exists(self, transaction):
-		for block in reversed(self.chain.blocks):
-			for txn in reversed(block.transactions):
-				if txn.transaction_id == transaction.transaction_id:
-					if DEBUG:
-						print("It already exists, returning")
-					return True
-		for txn in reversed(self.current_block.transactions):
-			if txn.transaction_id == transaction.transaction_id:
-				if DEBUG:
-					print("It already exists, returning")
-				return True
+		if self.chain.get_transaction_location(transaction.transaction_id) != None or transaction.transaction_id in self.get_current_block_transactions():
+			if DEBUG:
+				print("It already exists, returning")
+			return True
 		return False
 
 	'''
@@ -279,16 +337,33 @@ class Node:
 	def get_transaction_inputs(self, amount):
 		balance = self.get_wallet_balance(self.id, True)
 		if balance >= amount:
+			outputs = self.pending_UTXOs[self.id]
+			selected = self.coin_selection.select(outputs, amount)
+			self.selection_stats.record(None if selected == None else len(selected), len(outputs))
+			if selected == None:
+				return None
 			sum = 0
 			inputs = [] # list of Transaction_Input to be used
-			for transaction in self.pending_UTXOs[self.id]:
+			for transaction in selected:
 				sum += transaction.amount
-				inputs.append(Transaction_Input(transaction.id, transaction.recipient, transaction.amount))
-				if sum >= amount:
-					return (inputs, sum)
+				inputs.append(Transaction_Input(transaction.id, transaction.recipient, transaction.amount, transaction.index))
+			return (inputs, sum)
 		else:
 			return None
 
+	'''
+	Get statistics of coin selection (inputs per transaction) and of the size of the UTXO set
+
+	return: dict
+	'''
+	def get_selection_stats(self):
+		stats = self.selection_stats.get_stats()
+		stats['strategy'] = self.coin_selection.name
+		stats['utxos'] = len(self.UTXOs)
+		stats['pending_utxos'] = len(self.pending_UTXOs)
+		stats['wallet_utxos'] = len(self.pending_UTXOs[self.id])
+		return stats
+
 	'''
 	Creates a new Block object and returns it
 
@@ -306,13 +381,14 @@ class Node:
 		
 
 	'''
-	Creates a new wallet, including a new pair of private/public key using RSA.
+	Creates a new wallet, including a new pair of private/public key using the signature
+	scheme of config (config.signature_scheme, config.signature_key_size).
 	Implementation is in constructor of Wallet class in 'wallet.py'
 
 	return: Wallet
 	'''
 	def generate_wallet(self):
-		return Wallet()
+		return Wallet(signature.get_scheme(config.signature_scheme, config.signature_key_size))
 
 
 	'''
@@ -321,15 +397,147 @@ class Node:
 
 	return: None
 	'''
-	def register_node_to_ring(self, id, ip, port, public_key):
-		self.ring.append(dict(
-			id = id,
-			ip = ip,
-			port = port,
-			public_key = public_key
-		))
+	def register_node_to_ring(self, id, ip, port, public_key, signature_scheme=None):
+		if signature_scheme == None:
+			signature_scheme = self.wallet.scheme.name
+		self.ring.add(id, ip, port, public_key, signature_scheme)
 		self.current_id_count += 1
-		self.UTXOs.append([])
+
+	'''
+	Get the loaded public key object of a wallet of the ring (parsed once, when the node was registered)
+
+	Parameters:
+	-----------
+	address: str
+		short address of the wallet, as found in transactions
+
+	return: RSAPublicKey | Ed25519PublicKey | None
+		None if no node of the ring has this address
+	'''
+	def get_public_key(self, address):
+		return self.ring.get_public_key(address)
+
+
+	'''
+	Open the store where this node keeps its chain on disk and, if the node had been running
+	before (it saved its state there), reload its wallet, ring, chain and UTXOs from it
+
+	Parameters:
+	-----------
+	path: str
+		directory of the store
+
+	return: bool
+		whether the state of a previous run was reloaded
+	'''
+	def open_store(self, path):
+		self.store = BlockStore(path)
+		return self.load_state()
+
+	'''
+	Save what the node needs to restart (its id, private key and the ring) next to its chain, readable by
+	its owner only, called once the ring is complete. Blocks are saved by the store as they are added.
+
+	return: None
+	'''
+	def save_state(self):
+		if self.store == None:
+			return
+		state = {
+			'id': self.id,
+			'signature_scheme': self.wallet.scheme.name,
+			'signature_key_size': self.wallet.scheme.key_size,
+			'private_key': self.wallet.private_key,
+			'ring': self.ring
+		}
+		path = os.path.join(self.store.path, 'node.json')
+		if os.path.exists(path + '.tmp'):
+			os.remove(path + '.tmp') # left by a crash, it may have other permissions
+		# it contains the private key, only the owner can read it
+		with os.fdopen(os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as file:
+			file.write(jsonpickle.encode(state))
+		os.replace(path + '.tmp', path)
+		self.save_utxos()
+
+	'''
+	Save the UTXOs and undo records next to the chain, with the hash and height of the tip they
+	correspond to, so that a restart only connects the blocks added after them again
+
+	Parameters:
+	-----------
+	every: int
+		save only when the height of the chain is a multiple of it (see config.utxo_snapshot_interval)
+
+	return: None
+	'''
+	def save_utxos(self, every=1):
+		if self.store == None or len(self.chain.blocks) % every != 0:
+			return
+		snapshot = {
+			'tip': self.chain.tip.current_hash,
+			'height': len(self.chain.blocks) - 1,
+			'UTXOs': self.UTXOs,
+			'undo_records': list(self.undo_records.items())
+		}
+		path = os.path.join(self.store.path, 'utxos.json')
+		with open(path + '.tmp', 'w') as file:
+			file.write(jsonpickle.encode(snapshot))
+		os.replace(path + '.tmp', path)
+
+	'''
+	Reload the state saved by save_state(), the chain from the store and the UTXOs from the last
+	snapshot (see save_utxos()) by connecting the blocks after it again, or all the blocks if the
+	snapshot is missing or its tip isn't in the chain anymore
+
+	return: bool
+		False if there is no saved state (or no chain) in the store
+	'''
+	def load_state(self):
+		path = os.path.join(self.store.path, 'node.json')
+		if not os.path.exists(path) or len(self.store) == 0:
+			return False
+		with open(path) as file:
+			state = jsonpickle.decode(file.read())
+		self.id = state['id']
+		self.wallet = Wallet(signature.get_scheme(state['signature_scheme'], state['signature_key_size']), state['private_key'])
+		self.ring = state['ring']
+		self.current_id_count = len(self.ring)
+		self.chain = Blockchain(config.capacity, self.store)
+		self.UTXOs = UTXOSet()
+		self.undo_records = OrderedDict()
+		start = 0
+		path = os.path.join(self.store.path, 'utxos.json')
+		if os.path.exists(path):
+			with open(path) as file:
+				snapshot = jsonpickle.decode(file.read())
+			if self.chain.get_height(snapshot['tip']) == snapshot['height']:
+				self.UTXOs = snapshot['UTXOs']
+				self.undo_records = OrderedDict(snapshot['undo_records'])
+				start = snapshot['height'] + 1
+		self.pending_UTXOs = self.UTXOs.overlay()
+		for block in self.chain.blocks[start:]:
+			if block.index == 0:
+				# the genesis transaction has no outputs, its amount was given to the bootstrap node
+				first_txn = block.transactions[0]
+				self.UTXOs.add(Transaction_Output(first_txn.transaction_id, self.ring.get_id(first_txn.receiver_address), first_txn.amount))
+			else:
+				self.add_UTXOS(block)
+		self.current_block = Block(self.chain.tip.current_hash, self.chain.tip.index + 1)
+		return True
+
+	'''
+	Called after a restart, asks the other nodes for the blocks added while this node was down
+
+	return: None
+	'''
+	def catch_up(self):
+		with self.block_slot:
+			if self.resolving_conflicts.is_set():
+				return
+			self.resolving_conflicts.set()
+			self.interrupt.trigger("resolving conflicts")
+		_thread.start_new_thread(self.resolve_conflicts, ())
+
 
 	'''
 	Method to initialize nodes other than bootstrap, it is called after the other Node objects have been
@@ -339,24 +547,22 @@ class Node:
 	return: None
 	'''
 	def initialize_nodes(self):
-		# copy UTXOs to pending_UTXOs
-		for utxo in self.UTXOs:
-			self.pending_UTXOs.append(copy.deepcopy(utxo))
+		# start pending changes on top of UTXOs
+		self.pending_UTXOs = self.UTXOs.overlay()
 		time.sleep(15) # because it takes forever for other nodes to start their Flask servers in okeanos VMs
 
-		data = { 
-			'ring': jsonpickle.encode(self.ring),
-			'current_block': jsonpickle.encode(self.current_block),
-			'chain': jsonpickle.encode(self.chain),
-			'UTXOs': jsonpickle.encode(self.UTXOs)
-			}
+		data = self.encode_message({
+			'ring': self.ring,
+			'current_block': self.current_block,
+			'chain': self.chain,
+			'UTXOs': self.UTXOs
+			})
 
 		for node in self.ring:
 			if node['id'] == self.id:
 				continue
-			url = "http://" + node['ip'] + ":" + str(node['port']) + "/node/initialize"
-			req = requests.post(url, json=data)
-			if (not req.status_code == 200):
+			req = self.post_peer(node, "/node/initialize", data)
+			if req == None or not req.status_code == 200:
 				print("Problem")
 				exit(1)
 
@@ -364,8 +570,7 @@ class Node:
 			if node['id'] == self.id:
 				continue
 
-			while self.mining:
-				pass
+			self.mining_done.wait()
 
 			inputs, inputs_sum = self.get_transaction_inputs(100) # no need to check if it returns None, it's always correct
 			transaction = self.create_transaction(
@@ -385,13 +590,12 @@ class Node:
 		for node in self.ring:
 			if node['id'] == self.id:
 				continue
-			url = "http://" + node['ip'] + ":" + str(node['port']) + "/begin"
-			req = requests.post(url)
-			if (not req.status_code == 200):
+			req = self.post_peer(node, "/begin", {})
+			if req == None or not req.status_code == 200:
 				print("Problem")
 				exit(1)
 
-		self.begin_working = True
+		self.begin_working.set()
 
 
 	'''
@@ -421,26 +625,29 @@ class Node:
 		sender_wallet_NBCs = self.get_wallet_balance(sender_id, True)
 		if sender_wallet_NBCs < amount:
 			return
-		recipient_id = next(item for item in self.ring if item["ip"] == receiver_ip and item["port"] == receiver_port)['id'] # max n iterations
+		recipient_id = self.ring.get_by_endpoint(receiver_ip + ":" + str(receiver_port))['id']
+
+		transaction = Transaction(self.ring[sender_id]['address'], self.ring[recipient_id]['address'], amount, inputs)
+		if inputs_sum > amount: # no change output when the inputs add up exactly to the amount
+			output_sender = Transaction_Output(
+								transaction_id=transaction.transaction_id,
+								recipient=sender_id,
+								amount=inputs_sum - amount,
+								index=0
+							)
+			transaction.transaction_outputs.append(output_sender)
 
-		transaction = Transaction(self.ring[sender_id]['public_key'], self.ring[recipient_id]['public_key'], amount, inputs)
-		transaction.sign_transaction(self.wallet.private_key)
-		output_sender = Transaction_Output(
-							transaction_id=transaction.transaction_id,
-							recipient=sender_id,
-							amount=inputs_sum - amount
-						)
-		transaction.transaction_outputs.append(output_sender)
-
-		if DEBUG:
-			print("Created output for sender: " + str(output_sender.to_dict()))
+			if DEBUG:
+				print("Created output for sender: " + str(output_sender.to_dict()))
 
 		output_recipient = Transaction_Output(
 			transaction_id=transaction.transaction_id,
 			recipient=recipient_id,
-			amount=amount
+			amount=amount,
+			index=1
 		)
 		transaction.transaction_outputs.append(output_recipient)
+		transaction.sign_transaction(self.wallet.private_key_object)
 		return transaction
 
 
@@ -455,11 +662,52 @@ class Node:
 	return: None
 	'''
 	def broadcast_transaction(self, transaction):
-		json = { 'transaction': jsonpickle.encode(transaction) }
+		data = self.encode_message({ 'transaction': transaction })
 		for node in self.ring:
 			if node['id'] == self.id:
 				continue
-			requests.post("http://" + node['ip'] + ":" + str(node['port']) + "/transaction/receive", json=json)
+			self.post_peer(node, "/transaction/receive", data)
+
+	'''
+	Encode a message to other nodes in config.wire_format: 'binary' (see wire) or 'json' (every field
+	encoded with jsonpickle)
+
+	Parameters:
+	-----------
+	message: dict
+		the fields of the message
+
+	return: dict
+		keyword arguments of requests.post() that send it
+	'''
+	def encode_message(self, message):
+		if config.wire_format == 'binary':
+			return dict(data=wire.encode(message), headers={'Content-Type': wire.CONTENT_TYPE})
+		return dict(json={key: jsonpickle.encode(value) for key, value in message.items()})
+
+	'''
+	POST a message (see encode_message()) to another node. A node that can't be reached
+	or doesn't answer in time is reported, not treated as an error.
+
+	Parameters:
+	-----------
+	node: dict
+		the node of the ring to send to
+	path: str
+		endpoint, e.g. "/block/add"
+	data: dict
+		the encoded message
+
+	return: Response | None
+		None if there was no response
+	'''
+	def post_peer(self, node, path, data):
+		try:
+			return self.peers.post("http://" + node['ip'] + ":" + str(node['port']) + path, **data)
+		except RequestException as error:
+			print("Node #" + str(node['id']) + " unreachable: " + str(error))
+			return None
+
 
 
 	'''
@@ -475,33 +723,27 @@ class Node:
 		whether transaction is valid or not
 	'''
 	def validate_transaction(self, transaction):
-		verified = transaction.verify_signature()
+		verified = self.verifier.verify(transaction)
 		if verified:
 			# find id of sender
-			temp = None
-			for item in self.ring:
-				if item["public_key"] == transaction.sender_address:
-					temp = item["id"]
-			sender_id = temp
-			# for that sender, find all UTXOs that correspond to the inputs and delete them
-			for input in transaction.transaction_inputs:
-				utxo_to_be_deleted = next((x for x in self.pending_UTXOs[sender_id] if x.id == input.previous_output_id), None)
-				try:
-					if utxo_to_be_deleted == None:
-						if DEBUG:
-							print("IT IS NONE")
-							for i in range(0,config.nodes):
-								for utxo in self.pending_UTXOs[i]:
-									print(utxo.to_dict())
-							print(str(input.previous_output_id) + " -> '" + str(sender_id) + "' $" + str(input.amount))
-							print("\n")
-					self.pending_UTXOs[sender_id].remove(utxo_to_be_deleted)
-				except:
+			sender_id = self.ring.get_id(transaction.sender_address)
+			# every input must be an unspent output of the sender, spent only once by this transaction
+			outpoints = [input.get_outpoint() for input in transaction.transaction_inputs]
+			for outpoint in outpoints:
+				utxo = self.pending_UTXOs.get(outpoint)
+				if utxo == None or utxo.recipient != sender_id or outpoints.count(outpoint) > 1:
+					if DEBUG:
+						print("IT IS NONE")
+						for utxo in self.pending_UTXOs:
+							print(utxo.to_dict())
+						print(outpoint + " -> '" + str(sender_id) + "'")
+						print("\n")
 					return False
-			# add all (both) outputs to UTXOs
+			# delete them and add all (both) outputs to UTXOs
+			for outpoint in outpoints:
+				self.pending_UTXOs.spend(outpoint)
 			for output in transaction.transaction_outputs:
-				node_id = output.recipient
-				self.pending_UTXOs[node_id].append(output)
+				self.pending_UTXOs.add(output)
 			return True
 		else:
 			print("Error - Wrong signature")
@@ -522,17 +764,11 @@ class Node:
 	def add_transaction_to_block(self, transaction):
 		if DEBUG:
 			print("In adding txn to block, with block having txns: " + str(len(self.current_block.transactions)))
-			sender_id = None
-			receiver_id = None
-			for item in self.ring:
-				if item["public_key"] == transaction.sender_address:
-					sender_id = item["id"]
-				if item["public_key"] == transaction.receiver_address:
-					receiver_id = item["id"]
+			sender_id = self.ring.get_id(transaction.sender_address)
+			receiver_id = self.ring.get_id(transaction.receiver_address)
 			print("TXN => Sender: " + str(sender_id) + ", Receiver: " + str(receiver_id) + ", amount: " + str(transaction.amount))
 
-		while self.mining:
-			pass
+		self.mining_done.wait()
 
 		self.current_block.add_transaction(transaction)
 		if DEBUG:
@@ -555,8 +791,7 @@ class Node:
 	Parameters: none, but using self.block_received since it is set in endpoint /block/add
 	'''
 	def process_block_received(self):
-		while self.block_received == None:
-			pass
+		self.received_block.wait()
 
 		self.reinsert_transactions([self.current_block], self.block_received)
 		self.add_UTXOS(self.block_received)
@@ -564,17 +799,16 @@ class Node:
 		# remove transactions from pending_transactions that exist in new block received
 		for txn in self.block_received.transactions:
 			for pending_txn in self.pending_transactions.copy():
-				if txn.transaction_id == pending_txn.transaction_id and txn.sender_address == self.wallet.public_key:
+				if txn.transaction_id == pending_txn.transaction_id and txn.sender_address == self.wallet.address:
 					self.pending_transactions.remove(pending_txn)
 
 		# handle blocks
-		self.chain.blocks.append(self.block_received)
+		self.chain.add_block(self.block_received)
 		self.current_block = Block(self.block_received.current_hash, self.block_received.index + 1)
+		self.save_utxos(config.utxo_snapshot_interval)
 
-		# change pending UTXOs to new UTXOs
-		self.pending_UTXOs = []
-		for utxo in self.UTXOs:
-			self.pending_UTXOs.append(copy.deepcopy(utxo))
+		# discard pending changes, they are made again when transactions are recreated
+		self.pending_UTXOs.discard()
 
 		if DEBUG:
 			print("NEW UTXOS")
@@ -606,58 +840,49 @@ class Node:
 	def mine_block(self):
 		if DEBUG:
 			print("In mining")
-		self.mining = True
-		nonce = randint(0, 2**64)
+		self.mining_done.clear()
 		block = self.current_block
 		if block.previous_hash == -1 or 1:
-			block.previous_hash = self.chain.blocks[-1].current_hash
+			block.previous_hash = self.chain.tip.current_hash
 		block.index = len(self.chain.blocks)
-		while (True):
-			if self.resolving_conflicts:
+		# later than the median time, even if this node's clock is behind the others'
+		block.timestamp = max(time.time(), self.chain.get_median_time(block.index) + 0.001)
+		block.target = self.chain.get_target(block.index)
+		block.seal()
+		if not self.search_nonce(block):
+			if self.resolving_conflicts.is_set() or not self.received_block.is_set():
+				self.mining_done.set()
 				return
-			if self.received_block:
+			# it was validated against the tip when it was received, which may have changed since
+			if self.validate_block(self.block_received):
 				self.process_block_received()
-				self.received_block = False
-				self.mining = False
-				self.block_received = None
-				if self.lock.locked():
-					self.lock.release()
-				return # stop mining
-			block.nonce = nonce
-			block.current_hash = block.myHash()
-
-			if block.current_hash.startswith('0' * config.difficulty):
-				break
-
-			nonce = (nonce + 1) % (2**64)
+			self.mining_done.set()
+			self.release_received_block()
+			if self.lock.locked():
+				self.lock.release()
+			return # stop mining
 
 		if DEBUG:
 			print("FOUND SOLUTION with hash: " + str(block.current_hash))
 			for transaction in block.transactions:
-				sender_id = None
-				receiver_id = None
-				for item in self.ring:
-					if item["public_key"] == transaction.sender_address:
-						sender_id = item["id"]
-					if item["public_key"] == transaction.receiver_address:
-						receiver_id = item["id"]
+				sender_id = self.ring.get_id(transaction.sender_address)
+				receiver_id = self.ring.get_id(transaction.receiver_address)
 				print("Sender: " + str(sender_id) + ", Receiver: " + str(receiver_id) + ", amount: " + str(transaction.amount))
 				for t_input in transaction.transaction_inputs:
 					print("\tInput: { Owner" + str(t_input.owner) + ", Amount: " + str(t_input.amount) + " }")
 				for t_output in transaction.transaction_outputs:
 					print("\tOutput: { Recipient: " + str(t_output.recipient) + ", Amount: " + str(t_output.amount) + " }")
 			print()
-		self.chain.blocks.append(block)
+		self.chain.add_block(block)
 		self.current_block = Block(block.current_hash, block.index + 1)
 		# change UTXOs
-		self.UTXOs = []
-		for utxo in self.pending_UTXOs:
-			self.UTXOs.append(copy.deepcopy(utxo))
+		self.keep_undo_record(block, self.pending_UTXOs.commit())
+		self.save_utxos(config.utxo_snapshot_interval)
 
 		# remove all pending transactions of other nodes, since they
 		# will be recreated - keep current node's since they're recreations
 		for txn in self.pending_transactions.copy():
-			if txn.sender_address != self.wallet.public_key:
+			if txn.sender_address != self.wallet.address:
 				self.pending_transactions.remove(txn)
 
 		if DEBUG:
@@ -680,12 +905,145 @@ class Node:
 			# 	print(str(block.index) + ": " + str(block.current_hash))
 			# print()
 
-		self.mining = False
+		self.mining_done.set()
 		if self.lock.locked():
 			self.lock.release()
 		self.broadcast_block(block)
 
 
+	'''
+	Searches for the nonce of a block, either in this thread or in the pool of mining processes
+	(if config.mining_processes > 1). Stops as soon as a block is received or conflicts are being resolved.
+
+	Parameters:
+	-----------
+	block: Block
+		the block to be mined, its nonce and current_hash are set when a solution is found
+
+	return: bool
+		True if a solution was found, False if mining was interrupted
+	'''
+	def search_nonce(self, block):
+		start_time = time.time()
+		header_prefix = block.header_prefix()
+		if self.miner != None:
+			solution = self.miner.search(header_prefix, block.target, self.interrupt)
+			if solution == None:
+				self.interrupt.acknowledge(time.time() - start_time, self.miner.last_attempts)
+				return False
+			block.nonce, block.current_hash = solution
+			return True
+
+		# only the nonce changes between attempts, so hash the header prefix once and copy its state
+		header = hashlib.sha256(header_prefix)
+		target = block.target.to_bytes(32, 'big') # digests compare like the numbers they encode
+		interrupted = self.interrupt.event.is_set
+		start = nonce = randint(0, 2**64 - 1)
+		while (True):
+			if interrupted():
+				self.interrupt.acknowledge(time.time() - start_time, (nonce - start) % (2**64))
+				return False
+			attempt = header.copy()
+			attempt.update(nonce.to_bytes(8, 'big'))
+
+			if attempt.digest() < target:
+				block.nonce = nonce
+				block.current_hash = attempt.hexdigest()
+				return True
+
+			nonce = (nonce + 1) % (2**64)
+
+
+	'''
+	Called by endpoint /block/add: waits until the previous block received has been processed,
+	then validates the block and, if it is correct, hands it to the worker and stops mining.
+	Otherwise the block is kept in side_blocks: if it makes a side branch heavier than the chain,
+	the node switches to that branch (see reorganize()); if the blocks before it are missing,
+	it starts resolving conflicts (if not already doing so) to get them from the other nodes.
+
+	Parameters:
+	-----------
+	block: Block
+		the block received
+
+	return: bool
+		whether block is valid or not
+	'''
+	def receive_block(self, block):
+		with self.block_slot:
+			self.block_slot.wait_for(lambda: not self.received_block.is_set())
+			if self.validate_block(block):
+				self.block_received = block
+				self.received_block.set()
+				self.interrupt.trigger("block received")
+				return True
+			# already known, or not even a valid block on its own
+			if block.current_hash in self.side_blocks or self.chain.get_height(block.current_hash) != None or not self.check_block(block):
+				return False
+			self.side_blocks.add(block)
+			if self.resolving_conflicts.is_set():
+				return False
+			branch = self.side_blocks.get_branch(block.current_hash)
+			fork_height = self.chain.get_height(branch[0].previous_hash)
+			if fork_height == None:
+				# orphan, only the other nodes have the blocks before it
+				self.resolving_conflicts.set()
+				self.interrupt.trigger("resolving conflicts")
+				_thread.start_new_thread(self.resolve_conflicts, ())
+				return False
+			# blocks received earlier may follow this one, the heaviest branch through it counts
+			tips = self.side_blocks.get_tips(block.current_hash)
+			branch = max([self.side_blocks.get_branch(tip.current_hash) for tip in tips], key=self.get_branch_work)
+			if self.chain.get_chain_work(fork_height) + self.get_branch_work(branch) > self.chain.get_chain_work():
+				self.resolving_conflicts.set()
+				self.interrupt.trigger("switching branch")
+				_thread.start_new_thread(self.reorganize, (fork_height, branch))
+			return False
+
+	'''
+	Check what can be checked about a block without the blocks before it: its hash is the hash of its header,
+	meets the target in it and the header commits to the transactions, none of them twice, and its timestamp isn't
+	more than config.max_future_drift seconds ahead. Used before keeping a block in side_blocks.
+
+	return: bool
+	'''
+	def check_block(self, block):
+		if block.target == None or block.current_hash == None or block.timestamp > time.time() + config.max_future_drift:
+			return False
+		return int(block.current_hash, 16) < block.target and block.myHash() == block.current_hash and block.verify_merkle_root() and block.has_unique_transactions()
+
+	'''
+	Get the work of the blocks of a branch (see blockchain.get_work())
+
+	return: int
+	'''
+	def get_branch_work(self, branch):
+		return sum(get_work(block.target) for block in branch)
+
+	'''
+	Called after a block received has been processed (or discarded), lets endpoint /block/add
+	accept the next one and clears the interrupt unless conflicts are being resolved
+	'''
+	def release_received_block(self):
+		with self.block_slot:
+			self.block_received = None
+			self.received_block.clear()
+			if not self.resolving_conflicts.is_set():
+				self.interrupt.clear()
+			self.block_slot.notify_all()
+
+	'''
+	Called when conflicts have been resolved, clears the interrupt unless a block received is waiting
+	and wakes the worker up
+	'''
+	def finish_resolving_conflicts(self):
+		with self.block_slot:
+			self.resolving_conflicts.clear()
+			if not self.received_block.is_set():
+				self.interrupt.clear()
+			self.block_slot.notify_all()
+
+
 	'''
 	Broadcasts a block to the other nodes
 
@@ -697,35 +1055,49 @@ class Node:
 	return: None
 	'''
 	def broadcast_block(self, block):
+		data = self.encode_message({ 'block': block })
 		for node in self.ring:
 			if node['id'] == self.id:
 				continue
-			requests.post("http://" + node['ip'] + ":" + str(node['port']) + "/block/add", json={ 'block' : jsonpickle.encode(copy.deepcopy(block)), 'UTXOs': jsonpickle.encode(copy.deepcopy(self.UTXOs)) })
+			self.post_peer(node, "/block/add", data)
 
 
 		
 	'''
-	Validate the current and previous hash of block received by another node
+	Validate the current and previous hash of block received by another node, its timestamp
+	(later than the median time of the blocks before it, at most config.max_future_drift seconds ahead)
+	as well as the Merkle root and the signatures of its transactions
 
 	Parameters:
 	-----------
 	block: Block
 		the block received
-	difficulty: int
-		how many 0s the hash must have as a prefix
+	previous_block: Block
+		the block it must extend, by default the last block of this node's chain
+	chain: Blockchain
+		chain that previous_block belongs to, its history decides the target of block
 
 	return: bool
 		whether block is valid or not
 	'''
-	def validate_block(self, block, previous_block=None):
+	def validate_block(self, block, previous_block=None, chain=None):
+		if chain == None:
+			chain = self.chain
 		if previous_block == None:
-			previous_block = self.chain.blocks[-1]
+			previous_block = chain.tip
 		if DEBUG:
 			print("Previous block's hash: " + str(previous_block.current_hash))
 			print("Current block's phash: " + str(block.previous_hash))
-		if block.previous_hash == previous_block.current_hash and block.current_hash.startswith('0'*config.difficulty):
-			return True
-		return False
+		target = chain.get_target(previous_block.index + 1)
+		if block.previous_hash != previous_block.current_hash or block.target != target or int(block.current_hash, 16) >= target:
+			return False
+		if block.timestamp <= chain.get_median_time(previous_block.index + 1) or block.timestamp > time.time() + config.max_future_drift:
+			return False
+		# header must commit to the transactions sent (each once) and hash to the claimed hash
+		if not block.verify_merkle_root() or not block.has_unique_transactions() or block.myHash() != block.current_hash:
+			return False
+		# signatures already verified (e.g. when transactions were received) come from the cache
+		return self.verifier.verify_all(block.transactions)
 
 
 	# #concensus functions
@@ -744,7 +1116,7 @@ class Node:
 	def validate_chain(self, chain):
 		for i in range(0, len(chain.blocks)):
 			if i != 0: # not genesis
-				valid_block = self.validate_block(chain.blocks[i], chain.blocks[i-1])
+				valid_block = self.validate_block(chain.blocks[i], chain.blocks[i-1], chain)
 				if not valid_block:
 					return False
 		return True
@@ -753,6 +1125,7 @@ class Node:
 	'''
 	Function called when making changes to UTXOs using transactions of received block (assumed to be correct).
 	Basically performs the same job as validate_transaction, but without returning in case of failure.
+	The outputs actually spent and created are kept in the undo record of the block.
 
 	Parameters:
 	-----------
@@ -760,38 +1133,36 @@ class Node:
 		correct block received from other node.
 	'''
 	def add_UTXOS(self, block):
+		undo = dict(spent = [], created = [])
 		for transaction in block.transactions:
 			# find id of sender
-			temp = None
-			for item in self.ring:
-				if item["public_key"] == transaction.sender_address:
-					temp = item["id"]
-			sender_id = temp
+			sender_id = self.ring.get_id(transaction.sender_address)
 			# for that sender, find all UTXOs that correspond to the inputs and delete them
 			for input in transaction.transaction_inputs:
-				utxo_to_be_deleted = next((x for x in self.UTXOs[sender_id] if x.id == input.previous_output_id), None)
-				for x in self.UTXOs[sender_id]:
-					if x.id == input.previous_output_id:
-						utxo_to_be_deleted = x
-						break
-				try:
-					self.UTXOs[sender_id].remove(utxo_to_be_deleted)
-				except:
-					pass
+				utxo = self.UTXOs.get(input.get_outpoint())
+				if utxo != None and utxo.recipient == sender_id:
+					spent = self.UTXOs.spend(input.get_outpoint())
+					if input.get_outpoint() in undo['created']:
+						# created earlier in this block (chained change), it didn't exist before the block
+						undo['created'].remove(input.get_outpoint())
+					else:
+						undo['spent'].append(spent)
 			# add all (both) outputs to UTXOs (if they don't already exist)
 			for output in transaction.transaction_outputs:
-				flag = True
-				node_id = output.recipient
-				for utxo in self.UTXOs[node_id]:
-					if utxo.id == output.id:
-						flag = False
-						break
-				if flag:
-					self.UTXOs[node_id].append(output)
-				else:
-					pass
-					if DEBUG:
-						print("UTXO already exists, not adding it again")
+				if self.UTXOs.add(output):
+					undo['created'].append(output.get_outpoint())
+				elif DEBUG:
+					print("UTXO already exists, not adding it again")
+		self.keep_undo_record(block, undo)
+
+	'''
+	Keep the undo record of a block just connected, forgetting the oldest one when there are
+	more than config.undo_depth (deeper reorgs undo blocks from their transactions instead)
+	'''
+	def keep_undo_record(self, block, undo):
+		self.undo_records[block.current_hash] = undo
+		while len(self.undo_records) > config.undo_depth:
+			self.undo_records.popitem(last=False)
 
 
 	'''
@@ -819,7 +1190,7 @@ class Node:
 					continue
 				if DEBUG:
 					print("Checking txn: " + str(transaction.to_dict()['transaction_id']) + " $" + str(transaction.to_dict()['amount']))
-				if transaction.sender_address == self.wallet.public_key:
+				if transaction.sender_address == self.wallet.address:
 					for incoming_txn in block_received.transactions:
 						if DEBUG:
 							print("   with txn: " + str(incoming_txn.to_dict()['transaction_id']) + " $" + str(incoming_txn.to_dict()['amount']))
@@ -838,7 +1209,7 @@ class Node:
 
 		# add transactions to recreate before other self transactions in case they exists, so that
 		# they are processed in order all over again
-		first_node_txn = next((x for x in self.pending_transactions if x.sender_address == self.wallet.public_key), None)
+		first_node_txn = next((x for x in self.pending_transactions if x.sender_address == self.wallet.address), None)
 		if first_node_txn != None:
 			idx = self.pending_transactions.index(first_node_txn)
 			for txn_to_recreate in reversed(txns_to_recreate):
@@ -875,7 +1246,7 @@ class Node:
 
 		inputs, inputs_sum = temp
 
-		id = next((x['id'] for x in self.ring if x['public_key'] == transaction.receiver_address), None)
+		id = self.ring.get_id(transaction.receiver_address)
 
 		# create transaction
 		new_transaction = self.create_transaction(
@@ -887,13 +1258,15 @@ class Node:
         )
 		if transaction != None:
 			new_transaction.transaction_id = transaction.transaction_id
+			new_transaction.sign_transaction(self.wallet.private_key_object) # id is signed too
 		return new_transaction
 
 
 	'''
 	Function to undo 'correct' UTXOs that have been added to chain but ultimately are in wrong branch of chain.
-	Basiscally, undo all transactions (going backwards) by re-creating all the UTXOs that are inputs and remove
-	all the UTXOs that are outputs (since when adding them the reverse happens; inputs are removed and outputs are added).
+	Every block is reverted with the undo record kept when it was connected (outputs it spent are added back,
+	outputs it created are removed). Blocks without a record (received before this node started) are undone
+	by re-creating all the UTXOs that are inputs and removing all the UTXOs that are outputs of their transactions.
 
 	Parameters:
 	-----------
@@ -901,26 +1274,219 @@ class Node:
 		blocks in chain to be undone
 	'''
 	def undo_UTXOs(self, blocks):
-		# add previous UTXO(s)
-		for block in reversed(blocks):
-			for transaction in reversed(block.transactions):
-				for txn_input in transaction.transaction_inputs:
-					self.UTXOs[txn_input.owner].append(Transaction_Output(transaction.transaction_id, txn_input.owner, txn_input.amount))
-		
-		# remove current UTXOs
 		for block in reversed(blocks):
+			undo = self.undo_records.pop(block.current_hash, None)
+			if undo != None:
+				self.UTXOs.revert(undo)
+				continue
 			for transaction in reversed(block.transactions):
+				# remove current UTXOs
 				for txn_output in transaction.transaction_outputs:
-					for x in self.UTXOs[txn_output.recipient]:
-						if x.id == txn_output.id:
-							self.UTXOs[txn_output.recipient].remove(x)
+					self.UTXOs.spend(txn_output.get_outpoint())
+				# add previous UTXO(s)
+				for txn_input in transaction.transaction_inputs:
+					self.UTXOs.add(Transaction_Output(txn_input.previous_output_id, txn_input.owner, txn_input.amount, txn_input.previous_output_index))
 
 
 	'''
-	Function that resolves conflicts if a block is received that is not valid. It asks other nodes for
-	their chain and if they have a chain longer than its own, it brings this node up-to-date with correct branch
-	by removing the blocks that are in the wrong branch (and undoing respective transactions) and adding the 
-	correct blocks (and by performing the necessary transactions that exist in block).
+	Download the blocks of another node's chain after the last block it has in common with this chain:
+	headers first (they must link to each other and to that block, and meet their target), then the
+	blocks in batches of config.sync_batch, which must match the headers and be valid
+
+	Parameters:
+	-----------
+	node: dict
+		the node of the ring to download from
+	info: dict
+		its response to /chain/headers (length, work, fork_height, headers)
+
+	return: list of Block | None
+		None if the branch isn't valid or couldn't be downloaded
+	'''
+	def download_branch(self, node, info):
+		fork_height = info['fork_height']
+		headers = list(info['headers'])
+		# ask for the rest of the headers if they didn't fit in one response
+		while fork_height + 1 + len(headers) < info['length']:
+			more = self.request_peer(node, "/chain/headers", {'locator': headers[-1]['current_hash']}, ('current_block',))
+			# the locator is the last header received, the headers of the node's chain up to it are known
+			if more == None or not self.check_headers_response(more, fork_height + 1 + len(headers)) or len(more['headers']) == 0:
+				return None
+			headers += more['headers']
+
+		previous_hash = self.chain.blocks[fork_height].current_hash
+		for header in headers:
+			if header['previous_hash'] != previous_hash or header['target'] == None or get_header_hash(header) != header['current_hash'] or int(header['current_hash'], 16) >= header['target']:
+				return None
+			previous_hash = header['current_hash']
+
+		# blocks of side branches this node already has aren't downloaded again
+		blocks = []
+		while len(blocks) < len(headers):
+			known_block = self.side_blocks.get(headers[len(blocks)]['current_hash'])
+			if known_block == None:
+				break
+			blocks.append(known_block)
+		for start in range(fork_height + 1 + len(blocks), fork_height + 1 + len(headers), config.sync_batch):
+			batch = self.request_peer(node, "/chain/blocks", {'start': start, 'count': config.sync_batch}, ('blocks',))
+			if batch == None or type(batch.get('blocks')) != list or any(type(block) != Block for block in batch['blocks']):
+				return None
+			blocks += batch['blocks']
+		if len(blocks) < len(headers):
+			return None
+		blocks = blocks[:len(headers)]
+
+		for i in range(0, len(blocks)):
+			if blocks[i].current_hash != headers[i]['current_hash']:
+				return None
+		if not self.validate_branch(fork_height, blocks):
+			return None
+		return blocks
+
+	'''
+	Validate the blocks of a branch that follows the block of this chain at fork_height
+
+	return: bool
+	'''
+	def validate_branch(self, fork_height, blocks):
+		branch = self.chain.get_branch(fork_height + 1, blocks)
+		for i in range(0, len(blocks)):
+			previous_block = self.chain.blocks[fork_height] if i == 0 else blocks[i-1]
+			if not self.validate_block(blocks[i], previous_block, branch):
+				return False
+		return True
+
+
+	'''
+	GET an endpoint of another node, waiting at most config.peer_timeout seconds.
+	A node that can't be reached or doesn't answer with 200 is reported, not treated as an error.
+	With config.wire_format 'binary' the response is asked for in binary (see wire) and a node that
+	answers in JSON is reported, with 'json' objects in the response are encoded with jsonpickle.
+
+	Parameters:
+	-----------
+	node: dict
+		the node of the ring to ask
+	path: str
+		endpoint, e.g. "/chain/headers"
+	params: dict
+		query parameters
+	encoded: tuple of str
+		fields of the response that are objects, encoded with jsonpickle in JSON responses
+
+	return: dict | None
+		the response, None if there was none
+	'''
+	def request_peer(self, node, path, params, encoded=()):
+		url = "http://" + node['ip'] + ":" + str(node['port']) + path
+		headers = {'Accept': wire.CONTENT_TYPE} if config.wire_format == 'binary' else {}
+		try:
+			req = self.peers.get(url, params=params, headers=headers)
+		except RequestException as error:
+			print("Node #" + str(node['id']) + " unreachable: " + str(error))
+			return None
+		if (not req.status_code == 200):
+			print("Node #" + str(node['id']) + " answered " + path + " with status code " + str(req.status_code))
+			return None
+		try:
+			if req.headers.get('Content-Type') == wire.CONTENT_TYPE:
+				return wire.decode(req.content)
+			if config.wire_format != 'json':
+				raise ValueError("expected " + wire.CONTENT_TYPE + ", got " + str(req.headers.get('Content-Type')))
+			response = req.json()
+			for field in encoded:
+				response[field] = jsonpickle.decode(response[field])
+			return response
+		except (ValueError, KeyError) as error:
+			print("Node #" + str(node['id']) + " answered " + path + " with a malformed response: " + str(error))
+			return None
+
+	'''
+	Check a header received from another node before it is used: every field has the type of
+	the field of Block.get_header(), the hash is 64 hex characters and the nonce fits in 8 bytes
+
+	return: bool
+	'''
+	def check_header(self, header):
+		if type(header) != dict or type(header.get('index')) != int or type(header.get('previous_hash')) != str:
+			return False
+		if type(header.get('timestamp')) not in (int, float) or type(header.get('target')) != int or type(header.get('merkle_root')) != str:
+			return False
+		if type(header.get('nonce')) != int or not 0 <= header['nonce'] < 2**64:
+			return False
+		current_hash = header.get('current_hash')
+		return type(current_hash) == str and len(current_hash) == 64 and current_hash.strip('0123456789abcdef') == ''
+
+	'''
+	Check a response to /chain/headers before it is used: fields of the right types, a fork height
+	inside the blocks known (None if the node has no block in common with them), at least one header
+	when the node's chain goes past that height, no more headers than it has and well formed headers
+	(see check_header())
+
+	Parameters:
+	-----------
+	info: dict
+		the response
+	known: int
+		how many blocks the locator asked with describes, this chain's length by default
+
+	return: bool
+	'''
+	def check_headers_response(self, info, known=None):
+		if known == None:
+			known = len(self.chain.blocks)
+		if type(info) != dict or type(info.get('length')) != int or type(info.get('work')) != int:
+			return False
+		if type(info.get('headers')) != list or type(info.get('current_block')) != Block:
+			return False
+		fork_height = info.get('fork_height')
+		if fork_height == None:
+			return True
+		if type(fork_height) != int or not 0 <= fork_height < known or info['length'] <= fork_height:
+			return False
+		if info['length'] > fork_height + 1 and len(info['headers']) == 0:
+			return False
+		if len(info['headers']) > info['length'] - fork_height - 1:
+			return False
+		return all(self.check_header(header) for header in info['headers'])
+
+	'''
+	Ask all other nodes at the same time for the headers after the last block they have in common
+	with the chain described by a locator. Stops waiting as soon as a quorum of them has answered
+	(config.sync_quorum, a majority if None) or after config.peer_timeout seconds.
+
+	return: list of (dict, dict)
+		node of the ring and its response to /chain/headers, for every node that answered in time
+		(a malformed response is reported and left out, like a node that didn't answer)
+	'''
+	def request_headers(self, locator):
+		peers = [node for node in self.ring if node['id'] != self.id]
+		quorum = config.sync_quorum if config.sync_quorum != None else len(peers) // 2 + 1
+		futures = {self.peer_requests.submit(self.request_peer, node, "/chain/headers", {'locator': locator}, ('current_block',)): node for node in peers}
+		deadline = time.time() + config.peer_timeout
+		responses = []
+		pending = set(futures)
+		while len(pending) > 0 and len(responses) < quorum:
+			done, pending = wait(pending, timeout=max(deadline - time.time(), 0), return_when=FIRST_COMPLETED)
+			if len(done) == 0:
+				print(str(len(pending)) + " node(s) didn't answer in time")
+				break
+			for future in done:
+				if future.result() == None:
+					continue
+				if not self.check_headers_response(future.result()):
+					print("Node #" + str(futures[future]['id']) + " answered /chain/headers with a malformed response")
+					continue
+				responses.append((futures[future], future.result()))
+		return responses
+
+	'''
+	Function that resolves conflicts if a block is received whose previous blocks this node doesn't have.
+	It asks other nodes (all at the same time, see request_headers()) for the work of their chain and the
+	headers after the last block in common with its own (described by a locator) and if they have a chain
+	with more work than its own, it downloads only the blocks after that block (except those it already
+	has in side_blocks). Then it takes the lock, checks that the branch still follows its chain and has
+	more work, and switches to that branch (see switch_branch()).
 	'''
 	def resolve_conflicts(self):
 		if DEBUG:
@@ -933,87 +1499,134 @@ class Node:
 					print(utxo.to_dict())
 			print()
 
-		max_len = 0
-		max_info = None
-		for node in self.ring:
-			if node['id'] == self.id:
-				continue
-			url = "http://" + node['ip'] + ":" + str(node['port']) + "/chain/get"
-			req = requests.get(url)
-			if (not req.status_code == 200):
-				print("Status code not 200")
-				exit(1)
-			if len(jsonpickle.decode(req.json()['chain']).blocks) > max_len:
-				max_len = len(jsonpickle.decode(req.json()['chain']).blocks)
-				max_info = req.json()
+		locked = False
+		# whatever a node answers (or if anything fails), the lock is released and the worker goes on
+		try:
+			# heaviest chains first, a node whose blocks can't be downloaded (or have less work than it claims)
+			# is skipped for the next one
+			responses = self.request_headers(",".join(self.chain.get_locator()))
+			candidates = [(node, info) for node, info in responses if info['fork_height'] != None and info['work'] > self.chain.get_chain_work()]
+			candidates.sort(key=lambda candidate: candidate[1]['work'], reverse=True)
 
-		if max_len <= len(self.chain.blocks):
-			if DEBUG:
-				print("Exiting cause I'm right: " + str(max_len) + " <= " + str(len(self.chain.blocks)))
-			self.resolving_conflicts = False
-			return
+			if len(candidates) == 0:
+				if DEBUG:
+					print("Exiting cause I'm right: no chain has more work than " + str(self.chain.get_chain_work()))
+				return
 
-		while not self.lock.acquire(blocking=False):
-			pass
+			# downloads happen without the lock, the worker isn't held up by slow nodes
+			incoming_blocks = None
+			for max_node, max_info in candidates:
+				incoming_blocks = self.download_branch(max_node, max_info)
+				if incoming_blocks != None and self.chain.get_chain_work(max_info['fork_height']) + self.get_branch_work(incoming_blocks) > self.chain.get_chain_work():
+					break
+				incoming_blocks = None
 
-		self.current_block = jsonpickle.decode(max_info['current_block'])
-		incoming_chain = jsonpickle.decode(max_info['chain'])
-		
-		# decide how many current blocks to revert
-		blocks_to_add = 0
-		old_block_index = None
+			self.lock.acquire()
+			locked = True
+
+			# the chain may have changed while downloading
+			if incoming_blocks != None and (self.chain.get_height(incoming_blocks[0].previous_hash) != max_info['fork_height']
+				or self.chain.get_chain_work(max_info['fork_height']) + self.get_branch_work(incoming_blocks) <= self.chain.get_chain_work()):
+				incoming_blocks = None
+			if incoming_blocks == None:
+				if DEBUG:
+					print("Exiting cause the blocks received are not valid")
+				self.release_received_block()
+				return
+
+			self.current_block = max_info['current_block']
+			self.switch_branch(max_info['fork_height'], incoming_blocks)
+		finally:
+			if locked:
+				self.lock.release()
+			self.finish_resolving_conflicts()
+
+	'''
+	Called by receive_block() when a block received makes a side branch heavier than the chain: the
+	branch is validated and the node switches to it (see switch_branch()) with blocks it already has.
+	Blocks of the branch that aren't valid are forgotten.
+
+	Parameters:
+	-----------
+	fork_height: int
+		height of the last block of the chain the branch shares
+	branch: list of Block
+		blocks of the branch after it, from side_blocks
+	'''
+	def reorganize(self, fork_height, branch):
+		self.lock.acquire()
+		try:
+			# the chain may have changed since the block was received
+			if self.chain.get_height(branch[0].previous_hash) != fork_height or self.chain.get_chain_work(fork_height) + self.get_branch_work(branch) <= self.chain.get_chain_work():
+				if DEBUG:
+					print("Exiting cause the side branch is no longer heavier")
+			elif not self.validate_branch(fork_height, branch):
+				if DEBUG:
+					print("Exiting cause the side branch is not valid")
+				for block in branch:
+					self.side_blocks.remove(block.current_hash)
+			else:
+				# transactions of current_block are processed again on top of the branch
+				incoming_txn_ids = set(txn.transaction_id for block in branch for txn in block.transactions)
+				for txn in reversed(self.current_block.transactions):
+					if txn.transaction_id not in incoming_txn_ids:
+						self.pending_transactions.appendleft(txn)
+				self.current_block = Block(branch[-1].current_hash, branch[-1].index + 1)
+				self.switch_branch(fork_height, branch)
+		finally:
+			self.lock.release()
+			self.finish_resolving_conflicts()
+
+	'''
+	Brings this node up-to-date with another branch by removing the blocks that are in the wrong branch
+	(and undoing respective transactions, they are kept in side_blocks in case the node switches back)
+	and adding the correct blocks (and by performing the necessary transactions that exist in block).
+	Called with the lock acquired.
+
+	Parameters:
+	-----------
+	old_block_index: int
+		height of the last block of the chain the branch shares
+	incoming_blocks: list of Block
+		blocks of the branch after it, already validated
+	'''
+	def switch_branch(self, old_block_index, incoming_blocks):
+		blocks_to_add = len(incoming_blocks)
 
 		if DEBUG:
 			print("\nCurrent chain:")
 			for block in self.chain.blocks:
 				print(str(block.index) + ": " + str(block.current_hash))
-			print("\nIncoming chain:")
-			for incoming_block in incoming_chain.blocks:
+			print("\nIncoming blocks:")
+			for incoming_block in incoming_blocks:
 				print(str(incoming_block.index) + ": " + str(incoming_block.current_hash))
+			print("Found adding blocks to be " + str(blocks_to_add) + ", index to be " + str(old_block_index))
 			print("\n")
 
-		flag = False
-		for incoming_block in reversed(incoming_chain.blocks):
-			for block in reversed(self.chain.blocks):
-				if incoming_block.current_hash == block.current_hash:
-					old_block_index = self.chain.blocks.index(block)
-					if DEBUG:
-						print("Found adding blocks to be " + str(blocks_to_add) + " - breaking")
-						print("Found index to be " + str(old_block_index) + "       - breaking")
-					flag = True
-					break
-			if flag:
-				break
-			blocks_to_add += 1
-
 		if blocks_to_add == 0:
 			if DEBUG:
 				print("Exiting cause I got no changes to do")
-			self.block_received = None
-			self.received_block = False
-			if self.lock.locked():
-				self.lock.release()
-			self.resolving_conflicts = True
+			self.release_received_block()
 			return
 
 		# undo UTXOs that exist in the wrong part of current chain
-		self.undo_UTXOS(self.chain.blocks[old_block_index+1:])
+		self.undo_UTXOs(self.chain.blocks[old_block_index+1:])
 
 		# perform transactions that exist in the right part of incoming chain
-		for incoming_block in incoming_chain.blocks[-blocks_to_add:]:
+		for incoming_block in incoming_blocks:
 			self.add_UTXOS(incoming_block)
 
-		# create temporary block that holds all incoming correct transactions
-		temp_block = copy.deepcopy(incoming_chain.blocks[-blocks_to_add])
-		for incoming_block in incoming_chain.blocks[-blocks_to_add+1:]:
+		# ids of all incoming correct transactions
+		incoming_txn_ids = set()
+		for incoming_block in incoming_blocks:
 			for incoming_txn in incoming_block.transactions:
-				temp_block.transactions.append(incoming_txn)
+				incoming_txn_ids.add(incoming_txn.transaction_id)
 
 		# re-add transactions from non-valid part of chain (that also don't exist in incoming
 		# chain and therefore haven't been processed yet) to pending_transactions
 		for nonvalid_block in self.chain.blocks[old_block_index+1:]:
 			for nonvalid_txn in nonvalid_block.transactions:
-				if nonvalid_txn.transaction_id not in temp_block.transactions:
+				if nonvalid_txn.transaction_id not in incoming_txn_ids:
 					self.pending_transactions.appendleft(nonvalid_txn)
 
 		if DEBUG:
@@ -1022,24 +1635,22 @@ class Node:
 				print(str(block.index) + ": " + str(block.current_hash))
 			
 			print("\nIncoming chain to add:")
-			for incoming_block in incoming_chain.blocks[-blocks_to_add:]:
+			for incoming_block in incoming_blocks:
 				print(str(incoming_block.index) + ": " + str(incoming_block.current_hash))
 			print("\n")
 
-		self.chain.blocks = self.chain.blocks[:old_block_index+1]
-		for incoming_block in incoming_chain.blocks[-blocks_to_add:]:
-			self.chain.blocks.append(incoming_block)
+		for nonvalid_block in self.chain.blocks[old_block_index+1:]:
+			self.side_blocks.add(nonvalid_block)
+		self.chain.truncate(old_block_index+1)
+		for incoming_block in incoming_blocks:
+			self.chain.add_block(incoming_block)
+			self.side_blocks.remove(incoming_block.current_hash)
+		self.save_utxos(config.utxo_snapshot_interval)
 
 		# bring pending UTXOs up to date
-		self.pending_UTXOs = []
-		for utxo in self.UTXOs:
-			self.pending_UTXOs.append(copy.deepcopy(utxo))
+		self.pending_UTXOs.discard()
 
 		if DEBUG:
 			print("\nCurrent chain")
 			for block in self.chain.blocks:
 				print(str(block.index) + ": " + str(block.current_hash))
-
-		if self.lock.locked():
-			self.lock.release()
-		self.resolving_conflicts = True
@@ -0,0 +1,64 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class PeerClient:
+
+	'''
+	Initialize the client used for all traffic between nodes. Connections are kept alive and reused:
+	every peer (ip:port, pools are kept for up to `peers` of them) has its own pool of up to pool_size connections. A request that can't connect
+	is tried again up to retries times, waiting backoff, 2 * backoff, 4 * backoff... seconds in between
+	(a request that was sent is never repeated, so a block or transaction is never delivered twice).
+
+	Attributes
+	----------
+	session: Session
+		keeps the pools, one per peer
+	adapter: HTTPAdapter
+		the pools and retry settings of the session
+	timeout: float
+		seconds to wait for a peer to accept a connection and to answer, unless given per request
+	'''
+	def __init__(self, peers, pool_size, timeout, retries, backoff):
+		self.session = requests.Session()
+		retry = Retry(total=retries, connect=retries, read=0, status=0, redirect=0, backoff_factor=backoff)
+		self.adapter = HTTPAdapter(pool_connections=max(peers, 1), pool_maxsize=pool_size, max_retries=retry)
+		self.session.mount('http://', self.adapter)
+		self.timeout = timeout
+
+	def get(self, url, **kwargs):
+		kwargs.setdefault('timeout', self.timeout)
+		return self.session.get(url, **kwargs)
+
+	def post(self, url, **kwargs):
+		kwargs.setdefault('timeout', self.timeout)
+		return self.session.post(url, **kwargs)
+
+	'''
+	Get how many requests were sent and how many connections were created for them (attempts to
+	connect that failed included), per peer and in total (a request that didn't create a connection reused one)
+
+	return: dict
+	'''
+	def get_stats(self):
+		pools = self.adapter.poolmanager.pools
+		peers = {}
+		for key in pools.keys():
+			pool = pools.get(key)
+			if pool == None:
+				continue
+			peers[pool.host + ":" + str(pool.port)] = dict(
+				requests = pool.num_requests,
+				connections_created = pool.num_connections,
+				connections_reused = max(pool.num_requests - pool.num_connections, 0)
+			)
+		return dict(
+			requests = sum(peer['requests'] for peer in peers.values()),
+			connections_created = sum(peer['connections_created'] for peer in peers.values()),
+			connections_reused = sum(peer['connections_reused'] for peer in peers.values()),
+			peers = peers
+		)
+
+	def close(self):
+		self.session.close()
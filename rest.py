@@ -1,7 +1,10 @@
-from flask import Flask, request
+from flask import Flask
 from flask_cors import CORS
+from requests.exceptions import RequestException
 from blockchain import Blockchain
-import config, json, jsonpickle, logging, requests, _thread, os
+from ring import Ring
+from utxo import UTXOSet
+import config, json, logging, _thread, os
 from common_functions import *
 
 
@@ -22,21 +25,27 @@ When all nodes are inserted, bootstrap will use this endpoint to broadcast the r
 def receive_ring():
     if DEBUG:
         print("Received ring")
-    node.ring = jsonpickle.decode(request.json['ring'])
-    valid_chain = node.validate_chain(jsonpickle.decode(request.json['chain']))
+    message = read_message(ring=Ring, chain=Blockchain, current_block=Block, UTXOs=UTXOSet)
+    node.ring = message['ring'] # indexes and keys are rebuilt while decoding
+    if any(item['signature_scheme'] != node.wallet.scheme.name for item in node.ring):
+        print("Ring doesn't use signature scheme '" + node.wallet.scheme.name + "'")
+        exit(1)
+    valid_chain = node.validate_chain(message['chain'])
     _thread.start_new_thread(node.worker, ())
     if valid_chain: 
-        node.chain = jsonpickle.decode(request.json['chain'])
-        node.current_block = jsonpickle.decode(request.json['current_block'])
+        node.chain = message['chain']
+        node.current_block = message['current_block']
     else:
         print("Problem")
         exit(1)
-    node.UTXOs = jsonpickle.decode(request.json['UTXOs'])
-    # copy UTXOs to pending_UTXOs
-    for utxo in node.UTXOs:
-        node.pending_UTXOs.append(copy.deepcopy(utxo))
-    node.current_id_count = len(node.UTXOs)
-    # node.begin_working = True
+    node.UTXOs = message['UTXOs']
+    # start pending changes on top of UTXOs
+    node.pending_UTXOs = node.UTXOs.overlay()
+    node.current_id_count = len(node.ring)
+    if node.store != None:
+        node.chain.use_store(node.store)
+        node.save_state()
+    # node.begin_working.set()
     if config.simulation:
         _thread.start_new_thread(simulation, ())
     else:
@@ -46,7 +55,7 @@ def receive_ring():
 
 @app.route('/begin', methods=['POST'])
 def begin():
-    node.begin_working = True
+    node.begin_working.set()
     return "OK", 200
 
 
@@ -60,18 +69,36 @@ if __name__ == '__main__':
     args = parser.parse_args()
     port = args.port
     node.port = port
-    ipv4 = os.popen('ip addr show eth1 | grep "\<inet\>" | awk \'{ print $2 }\' | awk -F "/" \'{ print $1 }\'').read().strip()
-    data = {
-        'ip': ipv4,
-        'port': port,
-        'public_key': jsonpickle.encode(node.wallet.public_key)
-    }
-    req = requests.post('http://' + config.bootstrap_ip + ':5000/node/register', json=data)
-    if (not req.status_code == 200):
-        print("Problem")
-        exit(1)
+    if config.block_store != None and node.open_store(os.path.join(config.block_store, str(port))):
+        # restarted: chain, UTXOs and ring come from disk, ask the other nodes for what was missed
+        print("Reloaded chain of " + str(len(node.chain.blocks)) + " blocks")
+        node.ip = node.ring[node.id]['ip']
+        node.begin_working.set()
+        _thread.start_new_thread(node.worker, ())
+        node.catch_up()
+        _thread.start_new_thread(client, ())
+        app.run(host=node.ip, port=port)
+    else:
+        ipv4 = os.popen('ip addr show eth1 | grep "\<inet\>" | awk \'{ print $2 }\' | awk -F "/" \'{ print $1 }\'').read().strip()
+        data = {
+            'ip': ipv4,
+            'port': port,
+            'public_key': node.wallet.public_key,
+            'signature_scheme': node.wallet.scheme.name
+        }
+        try:
+            req = node.peers.post('http://' + config.bootstrap_ip + ':5000/node/register', **node.encode_message(data))
+        except RequestException as error:
+            print("Problem")
+            print("Bootstrap node unreachable: " + str(error))
+            exit(1)
+        if (not req.status_code == 200):
+            print("Problem")
+            if req.status_code == 400:
+                print(req.json()['error'])
+            exit(1)
 
-    node.id = json.loads(req.content.decode())['id']
-    node.current_id_count = node.id + 1
+        node.id = json.loads(req.content.decode())['id']
+        node.current_id_count = node.id + 1
 
-    app.run(host=ipv4, port=port)
\ No newline at end of file
+        app.run(host=ipv4, port=port)
\ No newline at end of file
@@ -0,0 +1,113 @@
+import signature
+from wallet import get_address
+
+
+class Ring:
+
+	'''
+	Initialize the registry of the nodes in the network, indexed so that every lookup
+	(by wallet address, by id or by ip:port) takes constant time
+
+	Attributes
+	----------
+	nodes: list of dict
+		every node's id, ip, port, public key (PEM), address and signature scheme, in order of id
+	by_address: dict
+		wallet address -> node
+	by_id: dict
+		id -> node
+	by_endpoint: dict
+		'ip:port' -> node
+	public_keys: dict
+		wallet address -> loaded public key object (parsed once per node)
+	'''
+	def __init__(self):
+		self.nodes = []
+		self.by_address = {}
+		self.by_id = {}
+		self.by_endpoint = {}
+		self.public_keys = {}
+
+	'''
+	Only the list of nodes is sent to other nodes, indexes and keys are rebuilt
+	(and addresses computed again from the public keys) when it is received
+	'''
+	def __getstate__(self):
+		return dict(nodes = self.nodes)
+
+	def __setstate__(self, state):
+		self.__init__()
+		for node in state['nodes']:
+			self.add(node['id'], node['ip'], node['port'], node['public_key'], node['signature_scheme'])
+
+	'''
+	Register a node
+
+	Parameters:
+	-----------
+	id: int
+		id of the node
+	ip: str
+		ip of the node
+	port: int
+		port of the node
+	public_key: bytes
+		public key (PEM) of the node's wallet
+	signature_scheme: str
+		name of the signature scheme of the node's wallet
+
+	return: dict
+		the node registered
+	'''
+	def add(self, id, ip, port, public_key, signature_scheme):
+		node = dict(
+			id = id,
+			ip = ip,
+			port = port,
+			public_key = public_key,
+			address = get_address(public_key),
+			signature_scheme = signature_scheme
+		)
+		self.nodes.append(node)
+		self.by_address[node['address']] = node
+		self.by_id[id] = node
+		self.by_endpoint[ip + ":" + str(port)] = node
+		self.public_keys[node['address']] = signature.load_public_key(public_key)
+		return node
+
+	def __iter__(self):
+		return iter(self.nodes)
+
+	def __len__(self):
+		return len(self.nodes)
+
+	'''
+	ring[id] returns the node with that id
+	'''
+	def __getitem__(self, id):
+		return self.by_id[id]
+
+	def get_by_address(self, address):
+		return self.by_address.get(address)
+
+	def get_by_endpoint(self, endpoint):
+		return self.by_endpoint.get(endpoint)
+
+	'''
+	Get the id of the node that owns a wallet address
+
+	return: int | None
+	'''
+	def get_id(self, address):
+		node = self.by_address.get(address)
+		if node == None:
+			return None
+		return node['id']
+
+	'''
+	Get the loaded public key of a wallet address
+
+	return: RSAPublicKey | Ed25519PublicKey | None
+	'''
+	def get_public_key(self, address):
+		return self.public_keys.get(address)
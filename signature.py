@@ -0,0 +1,147 @@
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
+
+
+class RSAScheme:
+
+	'''
+	RSA signatures with PSS padding and SHA-256
+
+	Attributes
+	----------
+	name: str
+		name used in config and in the ring registration
+	key_size: int
+		size of the keys generated, in bits
+	'''
+	name = 'rsa'
+
+	def __init__(self, key_size=4096):
+		self.key_size = key_size
+
+	def generate_private_key(self):
+		return rsa.generate_private_key(
+			public_exponent=65537,
+			key_size=self.key_size,
+			backend=default_backend()
+		)
+
+	def sign(self, private_key, message):
+		return private_key.sign(
+			message,
+			padding.PSS(
+				mgf=padding.MGF1(hashes.SHA256()),
+				salt_length=padding.PSS.MAX_LENGTH
+			),
+			hashes.SHA256()
+		)
+
+	def verify(self, public_key, signature, message):
+		public_key.verify(
+			signature,
+			message,
+			padding.PSS(
+				mgf=padding.MGF1(hashes.SHA256()),
+				salt_length=padding.PSS.MAX_LENGTH
+			),
+			hashes.SHA256()
+		)
+
+	def owns(self, key):
+		return isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey))
+
+
+class Ed25519Scheme:
+
+	'''
+	Ed25519 signatures: small keys, much faster key generation, signing and verification than RSA
+
+	Attributes
+	----------
+	name: str
+		name used in config and in the ring registration
+	key_size: int
+		size of the keys, in bits (fixed)
+	'''
+	name = 'ed25519'
+	key_size = 256
+
+	def generate_private_key(self):
+		return ed25519.Ed25519PrivateKey.generate()
+
+	def sign(self, private_key, message):
+		return private_key.sign(message)
+
+	def verify(self, public_key, signature, message):
+		public_key.verify(signature, message)
+
+	def owns(self, key):
+		return isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey))
+
+
+SCHEMES = [RSAScheme, Ed25519Scheme]
+
+
+'''
+Get a signature scheme by name
+
+Parameters:
+-----------
+name: str
+	'rsa' or 'ed25519'
+key_size: int
+	size of RSA keys, ignored by fixed-size schemes
+
+return: RSAScheme | Ed25519Scheme
+'''
+def get_scheme(name, key_size=4096):
+	if name == RSAScheme.name:
+		return RSAScheme(key_size)
+	if name == Ed25519Scheme.name:
+		return Ed25519Scheme()
+	raise ValueError("Unknown signature scheme '" + str(name) + "'")
+
+
+'''
+Get the scheme a loaded key belongs to, so that a transaction can be signed/verified
+with whatever kind of key its wallet has
+
+return: RSAScheme | Ed25519Scheme
+'''
+def get_key_scheme(key):
+	for scheme in (RSAScheme(), Ed25519Scheme()):
+		if scheme.owns(key):
+			return scheme
+	raise ValueError("Unsupported key type " + type(key).__name__)
+
+
+'''
+Sign a message with a loaded private key
+
+return: bytes
+'''
+def sign(private_key, message):
+	return get_key_scheme(private_key).sign(private_key, message)
+
+
+'''
+Verify the signature of a message with a loaded public key
+
+return: bool
+'''
+def verify(public_key, signature, message):
+	try:
+		get_key_scheme(public_key).verify(public_key, signature, message)
+	except:
+		return False
+	return True
+
+
+'''
+Parse a public key (PEM) of any supported scheme
+
+return: RSAPublicKey | Ed25519PublicKey
+'''
+def load_public_key(public_key):
+	return serialization.load_pem_public_key(public_key, backend=default_backend())
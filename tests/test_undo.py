@@ -0,0 +1,38 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import config
+config.signature_scheme = 'ed25519'
+config.mining_processes = 1
+from block import Block
+from node import Node
+from transaction import Transaction
+from transaction_io import Transaction_Output
+
+
+def test_undo_record_of_block_with_chained_spends():
+	node = Node('127.0.0.1', 5000, 0)
+	other = Node('127.0.0.1', 5001, 1)
+	node.register_node_to_ring(0, node.ip, node.port, node.wallet.public_key)
+	node.register_node_to_ring(1, other.ip, other.port, other.wallet.public_key)
+	genesis = Transaction(node.wallet.address, node.wallet.address, 100, [])
+	node.UTXOs.add(Transaction_Output(genesis.transaction_id, 0, 100))
+	node.pending_UTXOs = node.UTXOs.overlay()
+
+	# every transaction spends the change output of the one before it
+	block = Block(1, 1)
+	for amount in [10, 20, 30]:
+		inputs, inputs_sum = node.get_transaction_inputs(amount)
+		transaction = node.create_transaction(other.ip, other.port, amount, inputs, inputs_sum)
+		assert node.validate_transaction(transaction)
+		block.add_transaction(transaction)
+	node.pending_UTXOs.discard()
+	before = sorted(output.get_outpoint() for output in node.UTXOs)
+
+	node.add_UTXOS(block)
+	assert node.get_wallet_balance(0, False) == 40
+	assert node.get_wallet_balance(1, False) == 60
+	node.undo_UTXOs([block])
+
+	assert sorted(output.get_outpoint() for output in node.UTXOs) == before
+	assert node.get_wallet_balance(0, False) == 100
+	assert node.get_wallet_balance(1, False) == 0
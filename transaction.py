@@ -1,11 +1,9 @@
 from Crypto.Hash import SHA256
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding
 import json, time
+import merkle
+import signature
 
-import jsonpickle
+CACHED = ('signing_digest', 'encoding', 'leaf_hash') # computed from the other fields, never sent
 
 
 class Transaction:
@@ -16,9 +14,9 @@ class Transaction:
     Attributes
     ----------
     sender_address: str
-        public key of the sender's wallet
+        address of the sender's wallet (see wallet.get_address())
     receiver_address: str
-        public key of receiver's wallet
+        address of receiver's wallet
     amount: int
         amount of NBC to be transferred
     transaction_id: str
@@ -26,17 +24,63 @@ class Transaction:
     transaction_inputs: list of Transaction_Input
         list that contains transactions ids as inputs
     transaction_outputs: list of Transaction_Output
-        list that contains UTXOs
+        list that contains UTXOs (inputs and outputs become tuples once the transaction is signed)
+    signing_digest: bytes | None
+        cache of get_signing_digest(), cleared when any other field changes
+    encoding: bytes | None
+        cache of get_encoding(), cleared when any field changes
+    leaf_hash: str | None
+        cache of get_leaf_hash(), cleared when any field changes
     '''
+    signing_digest = None
+    encoding = None
+    leaf_hash = None
+
     def __init__(self, sender_address, receiver_address, amount, transaction_inputs):
-        self.sender_address = sender_address # To public key του wallet από το οποίο προέρχονται τα χρήματα
-        self.receiver_address = receiver_address # To public key του wallet στο οποίο θα καταλήξουν τα χρήματα
+        self.sender_address = sender_address # Η διεύθυνση του wallet από το οποίο προέρχονται τα χρήματα
+        self.receiver_address = receiver_address # Η διεύθυνση του wallet στο οποίο θα καταλήξουν τα χρήματα
         self.amount = amount # το ποσό που θα μεταφερθεί
         self.transaction_inputs = transaction_inputs # λίστα από Transaction Input 
         self.transaction_outputs = [] # λίστα από Transaction Output
         self.transaction_id = self.get_hash().hexdigest() # το hash του transaction
         self.signature = None
 
+    '''
+    Setting a field clears what was computed from it (only the encoding when it is the signature)
+    '''
+    def __setattr__(self, name, value):
+        if name not in CACHED:
+            self.__dict__['encoding'] = None
+            self.__dict__['leaf_hash'] = None
+            if name != 'signature':
+                self.__dict__['signing_digest'] = None
+        self.__dict__[name] = value
+
+    '''
+    Leave the caches out when the transaction is serialized or copied, they are computed again when needed
+    '''
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in CACHED:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name in CACHED:
+            self.__dict__[name] = None
+        if self.signature != None:
+            self.freeze()
+
+    '''
+    Make the inputs and outputs tuples of frozen objects, a signed transaction can't be changed in place
+    '''
+    def freeze(self):
+        self.__dict__['transaction_inputs'] = tuple(self.transaction_inputs)
+        self.__dict__['transaction_outputs'] = tuple(self.transaction_outputs)
+        for item in self.transaction_inputs + self.transaction_outputs:
+            item.freeze()
+
     '''
     Function that returns hash string used as transaction_id,
     using transaction information 
@@ -45,8 +89,8 @@ class Transaction:
     '''
     def get_hash(self):
         transaction_info = json.dumps(dict(
-            sender_address = jsonpickle.encode(self.sender_address),
-            receiver_address = jsonpickle.encode(self.receiver_address),
+            sender_address = self.sender_address,
+            receiver_address = self.receiver_address,
             amount = self.amount,
             transaction_inputs = [item.to_dict() for item in self.transaction_inputs],
             time=time.time()
@@ -59,61 +103,76 @@ class Transaction:
             signature = b""
 
         return dict(
-            sender_address = self.sender_address.decode('utf-8'),
-            receiver_address = self.receiver_address.decode('utf-8'),
+            sender_address = self.sender_address,
+            receiver_address = self.receiver_address,
             amount = self.amount,
             transaction_id = self.transaction_id,
             transaction_inputs = [item.to_dict() for item in self.transaction_inputs],
             transaction_outputs = [item.to_dict() for item in self.transaction_outputs],
             signature = signature.decode('utf-8', 'backslashreplace')
         )
-        
 
     '''
-    Sign transaction with private key
+    Digest of everything a transaction commits to (all fields except the signature),
+    this is what gets signed
+
+    return: bytes
+    '''
+    def get_signing_digest(self):
+        if self.signing_digest == None:
+            transaction_info = self.to_dict()
+            del transaction_info['signature']
+            self.signing_digest = SHA256.new(json.dumps(transaction_info, sort_keys=True).encode()).digest()
+        return self.signing_digest
+
+    '''
+    Canonical encoding of the transaction, signature included (what the Merkle tree of a block commits to),
+    computed once
+
+    return: bytes
+    '''
+    def get_encoding(self):
+        if self.encoding == None:
+            self.encoding = json.dumps(self.to_dict()).encode()
+        return self.encoding
+
+    '''
+    Leaf of the Merkle tree of a block for this transaction (see merkle.leaf_hash()), computed once
+
+    return: str
+    '''
+    def get_leaf_hash(self):
+        if self.leaf_hash == None:
+            self.leaf_hash = merkle.leaf_hash(self.get_encoding())
+        return self.leaf_hash
+
+    '''
+    Sign transaction with private key (after its outputs have been added). The transaction is
+    final from then on: its inputs and outputs can't be changed in place any more (see freeze()) and its encoding
+    and leaf hash are computed once, for the blocks it goes in.
 
     Parameters
     ----------
-    private_key: str
-        the private key of the sender's wallet
+    private_key: RSAPrivateKey | Ed25519PrivateKey
+        the loaded private key of the sender's wallet (Wallet.private_key_object)
     '''
     def sign_transaction(self, private_key):
-        private_key_loaded = serialization.load_pem_private_key(
-            private_key,
-            password = None,
-            backend=default_backend()
-        )
-
-        self.signature = private_key_loaded.sign(
-            b"",
-            padding.PSS(
-                mgf=padding.MGF1(hashes.SHA256()),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            hashes.SHA256()
-        )
-
-       
+        self.freeze()
+        self.signature = signature.sign(private_key, self.get_signing_digest())
+        self.get_leaf_hash()
 
     '''
     Verify signature of a transaction sent from another node.
-    No need to add the sender wallet's public key, since it exists in 
-    the Transaction object (self.sender_address)
+
+    Parameters
+    ----------
+    public_key: RSAPublicKey | Ed25519PublicKey
+        the loaded public key of the sender's wallet, i.e. of self.sender_address
+        (parsed once per key, see Node.get_public_key())
 
     return: bool
     '''
-    def verify_signature(self):
-        try:
-            self.sender_address.verify(
-                self.signature,
-                b"",
-                padding.PSS(
-                    mgf=padding.MGF1(hashes.SHA256()),
-                    salt_length=padding.PSS.MAX_LENGTH
-                ),
-                hashes.SHA256()
-            )
-        except:
+    def verify_signature(self, public_key):
+        if self.signature == None or public_key == None:
             return False
-        finally:
-            return True
\ No newline at end of file
+        return signature.verify(public_key, self.signature, self.get_signing_digest())
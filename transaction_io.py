@@ -1,4 +1,28 @@
-class Transaction_Input:
+from utxo import get_outpoint
+
+class Frozen:
+    '''
+    Inputs and outputs are frozen when their transaction is signed: its signature and the digests
+    it caches commit to their fields, so changing one in place would leave a stale (but valid) signature
+    '''
+    frozen = False
+
+    def __setattr__(self, name, value):
+        if self.frozen:
+            raise AttributeError(type(self).__name__ + " of a signed transaction can't be changed")
+        self.__dict__[name] = value
+
+    '''
+    Decoding (jsonpickle, wire) restores the fields directly, whether or not the object was frozen
+    '''
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def freeze(self):
+        self.__dict__['frozen'] = True
+
+
+class Transaction_Input(Frozen):
     '''
     Create a Transaction_Input object
 
@@ -6,21 +30,35 @@ class Transaction_Input:
     ----------
     previous_output_id: str
         id of the transaction output where the amount came from
+    owner: int
+        id of the node that owns the output
+    amount: int
+        the amount of the output
+    previous_output_index: int
+        position of the output in the outputs of its transaction
     '''
-    def __init__(self, previous_output_id, owner, amount):
+    def __init__(self, previous_output_id, owner, amount, previous_output_index=0):
         self.previous_output_id = previous_output_id
         self.owner = owner
         self.amount = amount
+        self.previous_output_index = previous_output_index
+
+    '''
+    Outpoint of the output spent by this input (see utxo.get_outpoint())
+    '''
+    def get_outpoint(self):
+        return get_outpoint(self.previous_output_id, self.previous_output_index)
 
     def to_dict(self):
         return dict(
             previous_output_id = self.previous_output_id,
+            previous_output_index = self.previous_output_index,
             owner=self.owner,
             amount=self.amount
         )
 
     
-class Transaction_Output:
+class Transaction_Output(Frozen):
     '''
     Create a Transaction_Output object
 
@@ -32,15 +70,25 @@ class Transaction_Output:
         id of the transaction's recipient (new coin owner)
     amount: int
         the amount transferred
+    index: int
+        position of the output in the outputs of its transaction
     '''
-    def __init__(self, transaction_id, recipient, amount):
+    def __init__(self, transaction_id, recipient, amount, index=0):
         self.id = transaction_id
         self.recipient = recipient
         self.amount = amount
+        self.index = index
+
+    '''
+    Outpoint of this output: unique, even though both outputs of a transaction share its id
+    '''
+    def get_outpoint(self):
+        return get_outpoint(self.id, self.index)
 
     def to_dict(self):
         return dict(
             id = self.id,
+            index = self.index,
             recipient = self.recipient,
             amount = self.amount
-        )
\ No newline at end of file
+        )
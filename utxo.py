@@ -0,0 +1,212 @@
+'''
+Get the outpoint of an output: the id of the transaction that created it and its position
+in that transaction's outputs, which identifies it uniquely
+
+return: str
+'''
+def get_outpoint(transaction_id, index):
+	return transaction_id + ":" + str(index)
+
+
+class UTXOSet:
+
+	'''
+	Initialize a set of unspent transaction outputs, indexed by outpoint
+	(O(1) lookup, spend and insert) and by owner (for balances and coin selection)
+
+	Attributes
+	----------
+	outputs: dict
+		outpoint -> Transaction_Output
+	by_owner: dict
+		node id -> dict of outpoint -> Transaction_Output, in the order they were added
+	balances: dict
+		node id -> sum of the amounts of its outputs, kept up to date by add() and spend()
+	'''
+	def __init__(self):
+		self.outputs = {}
+		self.by_owner = {}
+		self.balances = {}
+
+	'''
+	Only the outputs are sent to other nodes, indexes are rebuilt when they are received
+	'''
+	def __getstate__(self):
+		return dict(outputs = list(self.outputs.values()))
+
+	def __setstate__(self, state):
+		self.__init__()
+		for output in state['outputs']:
+			self.add(output)
+
+	'''
+	Add an output to the set
+
+	return: bool
+		False if it was already in the set
+	'''
+	def add(self, output):
+		outpoint = output.get_outpoint()
+		if outpoint in self.outputs:
+			return False
+		self.outputs[outpoint] = output
+		self.by_owner.setdefault(output.recipient, {})[outpoint] = output
+		self.balances[output.recipient] = self.balances.get(output.recipient, 0) + output.amount
+		return True
+
+	'''
+	Remove an output from the set
+
+	return: Transaction_Output | None
+		the output spent, None if it wasn't in the set
+	'''
+	def spend(self, outpoint):
+		output = self.outputs.pop(outpoint, None)
+		if output != None:
+			del self.by_owner[output.recipient][outpoint]
+			self.balances[output.recipient] -= output.amount
+		return output
+
+	def get(self, outpoint):
+		return self.outputs.get(outpoint)
+
+	def get_balance(self, owner):
+		return self.balances.get(owner, 0)
+
+	def __contains__(self, outpoint):
+		return outpoint in self.outputs
+
+	def __len__(self):
+		return len(self.outputs)
+
+	def __iter__(self):
+		return iter(list(self.outputs.values()))
+
+	'''
+	utxos[id] returns the outputs owned by node id, in the order they were added
+	'''
+	def __getitem__(self, owner):
+		return list(self.by_owner.get(owner, {}).values())
+
+	'''
+	Reverse the changes a block made to the set, using the undo record kept when it was connected
+
+	Parameters:
+	-----------
+	undo: dict
+		spent: list of Transaction_Output removed by the block
+		created: list of str, outpoints of the outputs added by the block
+	'''
+	def revert(self, undo):
+		for outpoint in reversed(undo['created']):
+			self.spend(outpoint)
+		for output in reversed(undo['spent']):
+			self.add(output)
+
+	'''
+	Get an empty overlay on top of this set, where changes can be made without touching it
+
+	return: UTXOOverlay
+	'''
+	def overlay(self):
+		return UTXOOverlay(self)
+
+
+class UTXOOverlay:
+
+	'''
+	Initialize a set of changes (outputs spent and created) on top of a UTXOSet. It is used
+	exactly like a UTXOSet, but the set below only changes when the overlay is committed,
+	so pending changes are kept or thrown away in time proportional to the changes only.
+
+	Attributes
+	----------
+	base: UTXOSet
+		the confirmed outputs
+	spent: set of str
+		outpoints of outputs of base spent in the overlay
+	created: dict
+		outpoint -> Transaction_Output created in the overlay (and not spent since)
+	created_by_owner: dict
+		node id -> dict of outpoint -> Transaction_Output, in the order they were created
+	balance_changes: dict
+		node id -> how much its balance changed in the overlay
+	'''
+	def __init__(self, base):
+		self.base = base
+		self.discard()
+
+	def add(self, output):
+		outpoint = output.get_outpoint()
+		if outpoint in self:
+			return False
+		self.balance_changes[output.recipient] = self.balance_changes.get(output.recipient, 0) + output.amount
+		if outpoint in self.spent and outpoint in self.base: # output of base spent and restored
+			self.spent.remove(outpoint)
+			return True
+		self.created[outpoint] = output
+		self.created_by_owner.setdefault(output.recipient, {})[outpoint] = output
+		return True
+
+	def spend(self, outpoint):
+		output = self.created.pop(outpoint, None)
+		if output != None:
+			del self.created_by_owner[output.recipient][outpoint]
+		else:
+			output = self.get(outpoint)
+			if output == None:
+				return None
+			self.spent.add(outpoint)
+		self.balance_changes[output.recipient] = self.balance_changes.get(output.recipient, 0) - output.amount
+		return output
+
+	def get(self, outpoint):
+		if outpoint in self.created:
+			return self.created[outpoint]
+		if outpoint in self.spent:
+			return None
+		return self.base.get(outpoint)
+
+	def get_balance(self, owner):
+		return self.base.get_balance(owner) + self.balance_changes.get(owner, 0)
+
+	def __contains__(self, outpoint):
+		return self.get(outpoint) != None
+
+	def __len__(self):
+		return len(self.base) - len(self.spent) + len(self.created)
+
+	def __iter__(self):
+		outputs = [output for output in self.base if output.get_outpoint() not in self.spent]
+		return iter(outputs + list(self.created.values()))
+
+	def __getitem__(self, owner):
+		outputs = [output for output in self.base[owner] if output.get_outpoint() not in self.spent]
+		return outputs + list(self.created_by_owner.get(owner, {}).values())
+
+	'''
+	Apply the changes to the set below and start over with no changes
+
+	return: dict
+		undo record of the changes (see UTXOSet.revert())
+	'''
+	def commit(self):
+		undo = dict(spent = [], created = [])
+		for outpoint in self.spent:
+			output = self.base.spend(outpoint)
+			if output != None:
+				undo['spent'].append(output)
+		for outpoint, output in self.created.items():
+			if self.base.add(output):
+				undo['created'].append(outpoint)
+		self.discard()
+		return undo
+
+	'''
+	Throw the changes away, the overlay becomes equal to the set below again
+	'''
+	def discard(self):
+		self.spent = set()
+		self.created = {}
+		self.created_by_owner = {}
+		self.balance_changes = {}
@@ -0,0 +1,102 @@
+import hashlib, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SignatureVerifier:
+
+	'''
+	Initialize the stage that verifies transaction signatures. Verifications run on a thread pool
+	(the cryptography backend releases the GIL while verifying) and every valid signature is
+	remembered, so a transaction verified when it entered pending_transactions is not verified
+	again when the block that contains it arrives.
+
+	Attributes
+	----------
+	executor: ThreadPoolExecutor
+		threads that verify signatures
+	get_public_key: function
+		returns the loaded public key of a sender_address (None if unknown)
+	cache: OrderedDict
+		transaction_id -> key of the verified content (signing digest + signature), least recently used first
+	cache_size: int
+		how many verified transactions are remembered
+	pending: dict
+		transaction_id -> (key, Future) of verifications submitted but not finished yet
+	hits: int
+		verifications answered from the cache
+	misses: int
+		verifications that had to check the signature
+	'''
+	def __init__(self, workers, cache_size, get_public_key):
+		self.executor = ThreadPoolExecutor(max_workers=workers)
+		self.get_public_key = get_public_key
+		self.cache = OrderedDict()
+		self.cache_size = cache_size
+		self.pending = {}
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	'''
+	Key of what is actually verified: the same transaction id with different content
+	or a different signature is never answered from the cache
+	'''
+	def get_key(self, transaction):
+		return hashlib.sha256(transaction.get_signing_digest() + (transaction.signature or b"")).digest()
+
+	def check(self, transaction, key):
+		valid = transaction.verify_signature(self.get_public_key(transaction.sender_address))
+		with self.lock:
+			self.pending.pop(transaction.transaction_id, None)
+			if valid:
+				self.cache[transaction.transaction_id] = key
+				self.cache.move_to_end(transaction.transaction_id)
+				while len(self.cache) > self.cache_size:
+					self.cache.popitem(last=False)
+		return valid
+
+	'''
+	Start verifying a transaction in the background (e.g. as soon as it is received),
+	unless it is already verified or being verified
+
+	return: Future | None
+		None if the result is already in the cache
+	'''
+	def submit(self, transaction):
+		key = self.get_key(transaction)
+		with self.lock:
+			if self.cache.get(transaction.transaction_id) == key:
+				self.cache.move_to_end(transaction.transaction_id)
+				self.hits += 1
+				return None
+			if transaction.transaction_id in self.pending and self.pending[transaction.transaction_id][0] == key:
+				self.hits += 1
+				return self.pending[transaction.transaction_id][1]
+			self.misses += 1
+			future = self.executor.submit(self.check, transaction, key)
+			self.pending[transaction.transaction_id] = (key, future)
+			return future
+
+	'''
+	Verify the signature of a transaction, from the cache if possible
+
+	return: bool
+	'''
+	def verify(self, transaction):
+		future = self.submit(transaction)
+		return future == None or future.result()
+
+	'''
+	Verify the signatures of many transactions (e.g. of a block) in parallel
+
+	return: bool
+		True only if every signature is valid
+	'''
+	def verify_all(self, transactions):
+		futures = [self.submit(transaction) for transaction in transactions]
+		return all(future == None or future.result() for future in futures)
+
+	def get_stats(self):
+		with self.lock:
+			return dict(cached = len(self.cache), hits = self.hits, misses = self.misses)
@@ -1,18 +1,43 @@
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives import serialization
+import hashlib
+
+ADDRESS_LENGTH = 40 # hex characters (160 bits)
+
+
+'''
+Get the short address of a wallet, used in transactions instead of the full public key:
+the first ADDRESS_LENGTH hex characters of the SHA-256 of its public key (PEM).
+Full public keys are kept only in the ring.
+
+Parameters
+----------
+public_key: bytes
+	public key of the wallet (PEM)
+
+return: str
+'''
+def get_address(public_key):
+	return hashlib.sha256(public_key).hexdigest()[:ADDRESS_LENGTH]
+
 
 class Wallet:
 
 	'''
 	Initialize a Wallet object that belongs to a Node in the network
+
+	Parameters
+	----------
+	scheme: RSAScheme | Ed25519Scheme
+		signature scheme used to generate the keys (see signature.get_scheme())
+	private_key: bytes | None
+		private key (PEM) of a wallet created before, a new one is generated if None
 	'''
-	def __init__(self):
-		private_key = rsa.generate_private_key(
-			public_exponent=65537,
-			key_size=4096,
-			backend=default_backend()
-		)
+	def __init__(self, scheme, private_key=None):
+		if private_key == None:
+			private_key = scheme.generate_private_key()
+		else:
+			private_key = serialization.load_pem_private_key(private_key, password=None)
+		self.scheme = scheme
 		self.private_key = private_key.private_bytes(
 			encoding=serialization.Encoding.PEM,
 			format=serialization.PrivateFormat.PKCS8,
@@ -26,4 +51,10 @@ class Wallet:
 			format=serialization.PublicFormat.SubjectPublicKeyInfo
 		)
 
+		self.address = get_address(self.public_key)
+
+		# loaded keys, so that signing never has to parse the PEM again
+		self.private_key_object = private_key
+		self.public_key_object = public_key
+
 		self.transactions = []
@@ -0,0 +1,283 @@
+import struct
+from block import Block
+from blockchain import Blockchain
+from ring import Ring
+from transaction import Transaction
+from transaction_io import Transaction_Input, Transaction_Output
+from utxo import UTXOSet
+
+FORMAT_VERSION = 1 # first byte of every message, a message of another version is rejected
+CONTENT_TYPE = 'application/x-noobcash'
+MAX_DEPTH = 32 # values nested deeper are rejected (a blockchain message is about 8 deep)
+
+# one byte before every value says what follows
+NONE, FALSE, TRUE, INT, FLOAT, STR, HEX, BYTES, LIST, DICT = range(0, 10)
+TRANSACTION_INPUT, TRANSACTION_OUTPUT, TRANSACTION, BLOCK, RING, UTXO_SET, BLOCKCHAIN = range(16, 23)
+
+NUMBER = (int, float)
+
+'''
+Fields of the objects sent as they are, in the order they are written (names are never sent), with the
+types they may have ([cls] is a list of cls). Only these classes (and Ring, UTXOSet, Blockchain, rebuilt
+from their contents) are ever created when decoding, whatever the message contains, and only with
+fields of those types.
+'''
+SCHEMAS = {
+	TRANSACTION_INPUT: (Transaction_Input, (('previous_output_id', (str,)), ('owner', (int,)), ('amount', NUMBER), ('previous_output_index', (int,)))),
+	TRANSACTION_OUTPUT: (Transaction_Output, (('id', (str,)), ('recipient', (int,)), ('amount', NUMBER), ('index', (int,)))),
+	TRANSACTION: (Transaction, (('sender_address', (str,)), ('receiver_address', (str,)), ('amount', NUMBER), ('transaction_inputs', [Transaction_Input]),
+		('transaction_outputs', [Transaction_Output]), ('transaction_id', (str,)), ('signature', (bytes, type(None))))),
+	BLOCK: (Block, (('index', (int,)), ('transactions', [Transaction]), ('nonce', (int,)), ('current_hash', (str, type(None))),
+		('previous_hash', (str, int)), ('timestamp', NUMBER), ('target', (int, type(None))), ('merkle_root', (str, type(None)))))
+}
+TAGS = {cls: tag for tag, (cls, fields) in SCHEMAS.items()}
+RING_FIELDS = (('id', (int,)), ('ip', (str,)), ('port', (int,)), ('public_key', (bytes,)), ('signature_scheme', (str,))) # address is computed again from the key
+
+DOUBLE = struct.Struct('>d')
+
+
+'''
+Encode a message sent to (or received from) another node: the format version, then the value
+
+Parameters:
+-----------
+value: None | bool | int | float | str | bytes | list | dict (str keys) | Transaction_Input |
+	Transaction_Output | Transaction | Block | Ring | UTXOSet | Blockchain, nested in any way
+
+return: bytes
+'''
+def encode(value):
+	out = bytearray([FORMAT_VERSION])
+	write_value(out, value)
+	return bytes(out)
+
+'''
+Decode a message encoded with encode()
+
+return: the value encoded
+'''
+def decode(data):
+	reader = Reader(data)
+	version = reader.read_byte()
+	if version != FORMAT_VERSION:
+		raise ValueError("Unsupported message version " + str(version))
+	value = reader.read_value()
+	if reader.position != len(reader.data):
+		raise ValueError("Unexpected data after the message")
+	return value
+
+
+def write_varint(out, number):
+	while number >= 0x80:
+		out.append((number & 0x7f) | 0x80)
+		number >>= 7
+	out.append(number)
+
+def write_bytes(out, data):
+	write_varint(out, len(data))
+	out += data
+
+'''
+Write a string as the bytes it encodes when it is lowercase hex (hashes, ids, addresses), half the size
+'''
+def write_str(out, value):
+	if len(value) % 2 == 0 and len(value) > 0 and value.strip('0123456789abcdef') == '':
+		out.append(HEX)
+		write_bytes(out, bytes.fromhex(value))
+	else:
+		out.append(STR)
+		write_bytes(out, value.encode())
+
+def write_value(out, value):
+	if value is None:
+		out.append(NONE)
+	elif value is True or value is False:
+		out.append(TRUE if value else FALSE)
+	elif type(value) == int:
+		out.append(INT)
+		write_varint(out, value * 2 if value >= 0 else -value * 2 - 1) # zigzag: small negatives stay short
+	elif type(value) == float:
+		out.append(FLOAT)
+		out += DOUBLE.pack(value)
+	elif type(value) == str:
+		write_str(out, value)
+	elif type(value) == bytes:
+		out.append(BYTES)
+		write_bytes(out, value)
+	elif type(value) in (list, tuple):
+		out.append(LIST)
+		write_varint(out, len(value))
+		for item in value:
+			write_value(out, item)
+	elif type(value) == dict:
+		out.append(DICT)
+		write_varint(out, len(value))
+		for key, item in value.items():
+			write_bytes(out, key.encode())
+			write_value(out, item)
+	elif type(value) in TAGS:
+		tag = TAGS[type(value)]
+		out.append(tag)
+		for field, types in SCHEMAS[tag][1]:
+			write_value(out, getattr(value, field))
+	elif type(value) == Ring:
+		out.append(RING)
+		write_value(out, [[node[field] for field, types in RING_FIELDS] for node in value])
+	elif type(value) == UTXOSet:
+		out.append(UTXO_SET)
+		write_value(out, list(value))
+	elif type(value) == Blockchain:
+		out.append(BLOCKCHAIN)
+		write_value(out, value.capacity)
+		write_value(out, list(value.blocks))
+	else:
+		raise TypeError("Can't encode " + type(value).__name__)
+
+'''
+Check that a decoded value has one of the types of a field (see SCHEMAS)
+
+Parameters:
+-----------
+name: str
+	the field, named in the error
+value:
+	the value decoded
+types: tuple of type | list of one type
+	the types allowed, or the type of every item of a list
+
+return: None, raises ValueError if the value has another type
+'''
+def check_type(name, value, types):
+	if type(types) == list:
+		if type(value) != list or any(type(item) != types[0] for item in value):
+			raise ValueError("Expected " + name + " to be a list of " + types[0].__name__)
+	elif type(value) not in types:
+		raise ValueError("Expected " + name + " to be " + " or ".join(t.__name__ for t in types) + ", got " + type(value).__name__)
+
+
+class Reader:
+
+	'''
+	Initialize a reader of an encoded message, every read checks that the message is long enough
+	and that values aren't nested more than MAX_DEPTH deep
+
+	Attributes
+	----------
+	data: bytes
+		the message
+	position: int
+		where the next read starts
+	depth: int
+		how many values the next read is nested in
+	'''
+	def __init__(self, data):
+		self.data = data
+		self.position = 0
+		self.depth = 0
+
+	def read_byte(self):
+		if self.position >= len(self.data):
+			raise ValueError("Message is truncated")
+		self.position += 1
+		return self.data[self.position - 1]
+
+	def read_varint(self):
+		number = 0
+		shift = 0
+		while True:
+			byte = self.read_byte()
+			number |= (byte & 0x7f) << shift
+			if byte < 0x80:
+				return number
+			shift += 7
+
+	def read_bytes(self):
+		length = self.read_varint()
+		if self.position + length > len(self.data):
+			raise ValueError("Message is truncated")
+		self.position += length
+		return bytes(self.data[self.position - length:self.position])
+
+	'''
+	Read a value that must be of one of the given types
+
+	return: the value
+	'''
+	def read_typed(self, *types):
+		value = self.read_value()
+		if type(value) not in types:
+			raise ValueError("Expected " + " or ".join(t.__name__ for t in types) + ", got " + type(value).__name__)
+		return value
+
+	def read_value(self):
+		if self.depth >= MAX_DEPTH:
+			raise ValueError("Message is nested more than " + str(MAX_DEPTH) + " deep")
+		self.depth += 1
+		try:
+			return self.read_tagged()
+		finally:
+			self.depth -= 1
+
+	def read_tagged(self):
+		tag = self.read_byte()
+		if tag == NONE:
+			return None
+		if tag == FALSE or tag == TRUE:
+			return tag == TRUE
+		if tag == INT:
+			number = self.read_varint()
+			return number // 2 if number % 2 == 0 else -(number + 1) // 2
+		if tag == FLOAT:
+			if self.position + DOUBLE.size > len(self.data):
+				raise ValueError("Message is truncated")
+			self.position += DOUBLE.size
+			return DOUBLE.unpack_from(self.data, self.position - DOUBLE.size)[0]
+		if tag == STR:
+			return self.read_bytes().decode()
+		if tag == HEX:
+			return self.read_bytes().hex()
+		if tag == BYTES:
+			return self.read_bytes()
+		if tag == LIST:
+			return [self.read_value() for _ in range(0, self.read_varint())]
+		if tag == DICT:
+			return {self.read_bytes().decode(): self.read_value() for _ in range(0, self.read_varint())}
+		if tag in SCHEMAS:
+			cls, fields = SCHEMAS[tag]
+			state = {}
+			for field, types in fields:
+				state[field] = self.read_value()
+				check_type(cls.__name__ + "." + field, state[field], types)
+			value = cls.__new__(cls)
+			if hasattr(value, '__setstate__'):
+				value.__setstate__(state)
+			else:
+				value.__dict__.update(state)
+			return value
+		if tag == RING:
+			ring = Ring()
+			for node in self.read_typed(list):
+				if type(node) != list or len(node) != len(RING_FIELDS):
+					raise ValueError("Malformed ring entry")
+				for value, (field, types) in zip(node, RING_FIELDS):
+					check_type("ring " + field, value, types)
+				try:
+					ring.add(*node)
+				except Exception as error: # the public key can't be loaded
+					raise ValueError("Malformed ring entry: " + str(error))
+			return ring
+		if tag == UTXO_SET:
+			utxos = UTXOSet()
+			for output in self.read_typed(list):
+				if type(output) != Transaction_Output:
+					raise ValueError("Expected Transaction_Output, got " + type(output).__name__)
+				utxos.add(output)
+			return utxos
+		if tag == BLOCKCHAIN:
+			chain = Blockchain(self.read_typed(int))
+			for block in self.read_typed(list):
+				if type(block) != Block:
+					raise ValueError("Expected Block, got " + type(block).__name__)
+				chain.add_block(block)
+			return chain
+		raise ValueError("Unknown tag " + str(tag))